@@ -1 +1,34 @@
+from collections import Counter
 
+from .utils import RELATION_COUNTERS, update_relation_counter
+
+
+class RelationCounterAdminMixin:
+    # New rows are counted by a post_save receiver; moved and deleted
+    # rows are accounted for here.
+
+    def get_target_field(self):
+        return RELATION_COUNTERS[self.model][0]
+
+    def save_model(self, request, obj, form, change):
+        field = self.get_target_field()
+        if change and field in form.changed_data:
+            update_relation_counter(self.model, [form.initial[field]], -1)
+            update_relation_counter(
+                self.model, [getattr(obj, f'{field}_id')], 1,
+            )
+        super().save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        update_relation_counter(
+            self.model, [getattr(obj, f'{self.get_target_field()}_id')], -1,
+        )
+
+    def delete_queryset(self, request, queryset):
+        targets = Counter(queryset.values_list(
+            f'{self.get_target_field()}_id', flat=True,
+        ))
+        super().delete_queryset(request, queryset)
+        for target_id, deleted in targets.items():
+            update_relation_counter(self.model, [target_id], -deleted)
@@ -1,6 +1,12 @@
+from django.db.models import F
 from django_filters import rest_framework
 from recipes.models import Recipe, Ingredient
 
+RECIPE_ORDERINGS = {
+    'popular': 'score__popular',
+    'trending': 'score__trending',
+}
+
 
 class RecipeFilter(rest_framework.FilterSet):
     is_favorited = rest_framework.filters.BooleanFilter(
@@ -9,10 +15,14 @@ class RecipeFilter(rest_framework.FilterSet):
     is_in_shopping_cart = rest_framework.filters.BooleanFilter(
         method='filter_is_in_shopping_cart'
     )
+    ordering = rest_framework.filters.ChoiceFilter(
+        choices=[(value, value) for value in RECIPE_ORDERINGS],
+        method='filter_ordering',
+    )
 
     class Meta:
         model = Recipe
-        fields = ['author', 'is_favorited', 'is_in_shopping_cart']
+        fields = ['author', 'is_favorited', 'is_in_shopping_cart', 'ordering']
 
     def filter_is_favorited(self, queryset, name, value):
         user = self.request.user
@@ -26,6 +36,14 @@ class RecipeFilter(rest_framework.FilterSet):
             return queryset.filter(in_carts__user=user)
         return queryset
 
+    def filter_ordering(self, queryset, name, value):
+        # Recipes not yet scored by refresh_recipe_scores go last.
+        return queryset.order_by(
+            F(RECIPE_ORDERINGS[value]).desc(nulls_last=True),
+            '-pub_date',
+            '-id',
+        )
+
 
 class IngredientFilter(rest_framework.FilterSet):
     name = rest_framework.filters.CharFilter(
@@ -0,0 +1,197 @@
+import json
+import statistics
+import time
+import tracemalloc
+from pathlib import Path
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries, transaction
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from api.utils import get_catalog_snapshot, search_ingredients
+from profiles.models import User
+from recipes.models import Ingredient, Recipe
+
+DEFAULT_BUDGETS = (
+    Path(__file__).resolve().parents[2] / 'benchmark_budgets.json'
+)
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет число запросов, задержку и память основных эндпоинтов API '
+        'и сравнивает их с бюджетами'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--budgets',
+            type=Path,
+            default=DEFAULT_BUDGETS,
+            help='JSON-файл с пороговыми значениями.',
+        )
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--recipes', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--no-seed',
+            action='store_true',
+            help='Использовать уже загруженные данные.',
+        )
+        parser.add_argument(
+            '--output',
+            type=Path,
+            help='Сохранить результаты замеров в JSON-файл.',
+        )
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 2:
+            raise CommandError('--iterations должно быть не меньше 2.')
+        budgets = json.loads(options['budgets'].read_text(encoding='utf-8'))
+        try:
+            with transaction.atomic():
+                if not options['no_seed']:
+                    self.seed(options)
+                results = self.run_benchmarks(options['iterations'])
+                raise Rollback
+        except Rollback:
+            pass
+
+        if options['output']:
+            options['output'].write_text(
+                json.dumps(results, indent=2), encoding='utf-8',
+            )
+        self.print_results(results)
+        failures = self.check_budgets(results, budgets)
+        if failures:
+            raise CommandError(
+                'Превышены бюджеты:\n' + '\n'.join(failures)
+            )
+        self.stdout.write(self.style.SUCCESS('Все бюджеты соблюдены'))
+
+    def seed(self, options):
+        if not Ingredient.objects.exists():
+            call_command('import_ingredients', stdout=self.stdout)
+        call_command(
+            'generate_test_data',
+            users=options['users'],
+            recipes=options['recipes'],
+            seed=options['seed'],
+            stdout=self.stdout,
+        )
+        call_command('refresh_recipe_scores', stdout=self.stdout)
+
+    def get_endpoints(self):
+        user = User.objects.annotate(
+            follows=Count('follower'),
+            cart=Count('shopping_cart'),
+        ).filter(cart__gt=0).order_by('-follows').first()
+        recipe = Recipe.objects.first()
+        if user is None or recipe is None:
+            raise CommandError('Недостаточно данных для замеров.')
+        return user, {
+            'recipes-list': (reverse('api:recipe-list'), {}),
+            'recipes-popular': (
+                reverse('api:recipe-list'), {'ordering': 'popular'},
+            ),
+            'recipes-detail': (
+                reverse('api:recipe-detail', args=[recipe.id]), {},
+            ),
+            'users-subscriptions': (
+                reverse('api:user-subscriptions'), {'recipes_limit': 3},
+            ),
+            'ingredients-search': (
+                reverse('api:ingredient-list'), {'name': 'са'},
+            ),
+            'download-shopping-cart': (
+                reverse('api:recipe-download-shopping-cart'), {},
+            ),
+        }
+
+    def request(self, client, url, params):
+        response = client.get(url, params)
+        if response.status_code != 200:
+            raise CommandError(f'{url}: статус {response.status_code}')
+        if response.streaming:
+            b''.join(response.streaming_content)
+        else:
+            response.content
+        return response
+
+    def clear_caches(self):
+        cache.clear()
+        search_ingredients.cache_clear()
+        get_catalog_snapshot.cache_clear()
+
+    def count_queries(self, client, url, params):
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            self.request(client, url, params)
+        return len(queries)
+
+    def run_benchmarks(self, iterations):
+        user, endpoints = self.get_endpoints()
+        client = APIClient(SERVER_NAME='localhost')
+        client.force_authenticate(user)
+        results = {}
+        for name, (url, params) in endpoints.items():
+            self.request(client, url, params)
+            # Cold budgets catch regressions hidden behind the caches.
+            self.clear_caches()
+            cold_queries = self.count_queries(client, url, params)
+            queries = self.count_queries(client, url, params)
+
+            timings = []
+            for _ in range(iterations):
+                started = time.perf_counter()
+                self.request(client, url, params)
+                timings.append((time.perf_counter() - started) * 1000)
+
+            tracemalloc.start()
+            self.request(client, url, params)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            quantiles = statistics.quantiles(timings, n=20)
+            results[name] = {
+                'queries': queries,
+                'cold_queries': cold_queries,
+                'p50_ms': round(statistics.median(timings), 2),
+                'p95_ms': round(quantiles[-1], 2),
+                'peak_kb': round(peak / 1024, 1),
+            }
+        return results
+
+    def print_results(self, results):
+        self.stdout.write(
+            f'{"эндпоинт":<24}{"запросы":>9}{"без кеша":>10}'
+            f'{"p50, мс":>10}{"p95, мс":>10}{"память, КБ":>13}'
+        )
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<24}{result["queries"]:>9}'
+                f'{result["cold_queries"]:>10}{result["p50_ms"]:>10}'
+                f'{result["p95_ms"]:>10}{result["peak_kb"]:>13}'
+            )
+
+    def check_budgets(self, results, budgets):
+        failures = []
+        for name, limits in budgets.items():
+            if name not in results:
+                failures.append(f'{name}: нет результатов')
+                continue
+            for metric, limit in limits.items():
+                value = results[name][metric]
+                if value > limit:
+                    failures.append(f'{name}: {metric} {value} > {limit}')
+        return failures
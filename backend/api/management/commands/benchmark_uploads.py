@@ -0,0 +1,105 @@
+import base64
+import multiprocessing
+import os
+import resource
+import time
+import tracemalloc
+from io import BytesIO
+
+from django.core.management.base import BaseCommand, CommandError
+from foodgram_backend.image_field import MAX_IMAGE_SIZE, Base64ImageField
+from PIL import Image
+from rest_framework import serializers
+
+
+def decode_legacy(data):
+    _, imgstr = data.split(';base64,')
+    file_data = base64.b64decode(imgstr)
+    if len(file_data) > MAX_IMAGE_SIZE:
+        raise serializers.ValidationError()
+    return file_data
+
+
+def decode_field(data):
+    return Base64ImageField().to_internal_value(data)
+
+
+DECODERS = {
+    'b64decode': decode_legacy,
+    'Base64ImageField': decode_field,
+}
+
+
+def make_payload(size):
+    if size > MAX_IMAGE_SIZE:
+        content = os.urandom(size)
+    else:
+        # Noise does not compress, so the PNG is about side² * 3 bytes.
+        side = int((size * 0.95 / 3) ** 0.5)
+        buffer = BytesIO()
+        Image.frombytes('RGB', (side, side), os.urandom(side * side * 3)) \
+            .save(buffer, 'PNG', compress_level=1)
+        content = buffer.getvalue()
+    return f'data:image/png;base64,{base64.b64encode(content).decode()}'
+
+
+def measure(decoder, data, results):
+    # ru_maxrss of a forked child starts at the parent's RSS, so the
+    # growth is what this upload alone needed.
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        DECODERS[decoder](data)
+        outcome = 'принят'
+    except serializers.ValidationError:
+        outcome = 'отклонен'
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results.put({
+        'outcome': outcome,
+        'ms': round(elapsed * 1000, 1),
+        'rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before,
+        'heap_kb': round(peak / 1024),
+    })
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет пиковое потребление памяти при декодировании '
+        'изображений в base64 разного размера'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            type=float,
+            nargs='+',
+            default=[1, 4.5, 15],
+            help='Размеры декодированных файлов в МБ.',
+        )
+
+    def handle(self, *args, **options):
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise CommandError('Замер требует запуска процессов через fork.')
+        context = multiprocessing.get_context('fork')
+        self.stdout.write(
+            f'{"размер, МБ":>11}{"способ":>18}{"результат":>11}'
+            f'{"мс":>9}{"RSS, КБ":>10}{"куча, КБ":>10}'
+        )
+        for size in options['sizes']:
+            data = make_payload(int(size * 1024 * 1024))
+            for decoder in DECODERS:
+                results = context.Queue()
+                process = context.Process(
+                    target=measure, args=(decoder, data, results),
+                )
+                process.start()
+                result = results.get()
+                process.join()
+                self.stdout.write(
+                    f'{size:>11}{decoder:>18}{result["outcome"]:>11}'
+                    f'{result["ms"]:>9}{result["rss_kb"]:>10}'
+                    f'{result["heap_kb"]:>10}'
+                )
@@ -1,6 +1,214 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import hashlib
+import json
+from collections import OrderedDict
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    page_size = 10
+    page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def __init__(self, ordering):
+        self.ordering = ordering
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return page_size if page_size > 0 else self.page_size
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return False, None
+        try:
+            reverse, values = json.loads(
+                base64.urlsafe_b64decode(encoded.encode())
+            )
+            if len(values) != len(self.ordering):
+                raise ValueError
+            values = [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return bool(reverse), values
+
+    def encode_cursor(self, obj, reverse):
+        values = [getattr(obj, field.lstrip('-')) for field in self.ordering]
+        cursor = json.dumps([reverse, values], default=str)
+        return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+    def get_position_filter(self, values, reverse):
+        position = Q(pk__in=[])
+        equal = Q()
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != reverse
+            lookup = 'lt' if descending else 'gt'
+            position |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return position
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        reverse, values = self.decode_cursor(request, queryset.model)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = [
+                field[1:] if field.startswith('-') else f'-{field}'
+                for field in ordering
+            ]
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(
+                self.get_position_filter(values, reverse)
+            )
+
+        page = list(queryset[:page_size + 1])
+        has_more = len(page) > page_size
+        page = page[:page_size]
+        if reverse:
+            page.reverse()
+
+        self.has_next = has_more if not reverse else True
+        self.has_previous = has_more if reverse else values is not None
+        self.page = page
+        return page
+
+    def get_link(self, obj, reverse):
+        cursor = self.encode_cursor(obj, reverse) if obj is not None else ''
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            cursor,
+        )
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.get_link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return self.get_link(None, reverse=True)
+        return self.get_link(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', None),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+
+COUNT_VERSION_KEY = 'pagination-count-version'
+
+
+def get_count_version():
+    return cache.get_or_set(COUNT_VERSION_KEY, 1, timeout=None)
+
+
+def bump_count_version():
+    try:
+        cache.incr(COUNT_VERSION_KEY)
+    except ValueError:
+        cache.set(COUNT_VERSION_KEY, 1, timeout=None)
+
+
+def estimate_count(queryset):
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql' or queryset.query.where:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+            [queryset.model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    if row and row[0] >= settings.PAGINATION_ESTIMATE_THRESHOLD:
+        return row[0]
+    return None
+
+
+class CachedCountPaginator(Paginator):
+
+    def __init__(self, *args, cache_key=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_key = cache_key
+
+    @cached_property
+    def count(self):
+        count = cache.get(self.cache_key)
+        if count is None:
+            count = estimate_count(self.object_list)
+            if count is None:
+                count = self.object_list.count()
+            cache.set(
+                self.cache_key,
+                count,
+                settings.PAGINATION_COUNT_CACHE_TIMEOUT,
+            )
+        return count
 
 
 class CustomPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'limit'
+    keyset = None
+    count_cache_key = None
+
+    @property
+    def django_paginator_class(self):
+        return partial(CachedCountPaginator, cache_key=self.count_cache_key)
+
+    def get_count_cache_key(self, request):
+        params = sorted(
+            (key, value)
+            for key, values in request.query_params.lists()
+            if key not in [self.page_query_param, self.page_size_query_param]
+            for value in values
+        )
+        digest = hashlib.md5(
+            json.dumps([request.path, params]).encode()
+        ).hexdigest()
+        return (
+            f'pagination-count:{get_count_version()}:'
+            f'{request.user.pk or 0}:{digest}'
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        ordering = getattr(view, 'keyset_ordering', None)
+        if ordering and KeysetPagination.cursor_query_param in \
+                request.query_params:
+            self.keyset = KeysetPagination(ordering)
+            return self.keyset.paginate_queryset(queryset, request, view)
+        self.count_cache_key = self.get_count_cache_key(request)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
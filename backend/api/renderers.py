@@ -0,0 +1,107 @@
+import csv
+import io
+from pathlib import Path
+
+from django.conf import settings
+from rest_framework.renderers import BaseRenderer
+
+from .utils import group_by_unit
+
+CART_TITLE = 'Список покупок'
+CHUNK_SIZE = 64 * 1024
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+class ShoppingCartRenderer(BaseRenderer):
+    # Subclasses stream the file through stream(ingredients); error
+    # responses of the action are rendered as JSON by the view.
+    charset = 'utf-8'
+
+    def get_content_type(self):
+        if self.charset:
+            return f'{self.media_type}; charset={self.charset}'
+        return self.media_type
+
+    def get_filename(self):
+        return f'shopping_cart.{self.format}'
+
+
+class ShoppingCartTextRenderer(ShoppingCartRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients):
+        yield f'{CART_TITLE}:\n'
+        for unit, items in group_by_unit(ingredients):
+            yield f'\n{unit}:\n'
+            for name, amount in items:
+                yield f'- {name}: {amount}\n'
+
+
+class ShoppingCartCSVRenderer(ShoppingCartRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, ingredients):
+        writer = csv.writer(Echo())
+        yield writer.writerow(
+            ('Ингредиент', 'Единица измерения', 'Количество')
+        )
+        for unit, items in group_by_unit(ingredients):
+            for name, amount in items:
+                yield writer.writerow((name, unit, amount))
+
+
+class ShoppingCartPDFRenderer(ShoppingCartRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    font_name = 'ShoppingCartFont'
+    font_size = 12
+    line_height = 18
+    margin = 50
+
+    def get_font(self):
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+
+        font_path = Path(settings.SHOPPING_CART_PDF_FONT)
+        if not font_path.exists():
+            return 'Helvetica'
+        if self.font_name not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(TTFont(self.font_name, font_path))
+        return self.font_name
+
+    def stream(self, ingredients):
+        from reportlab.lib.pagesizes import A4
+        from reportlab.pdfgen import canvas
+
+        buffer = io.BytesIO()
+        pdf = canvas.Canvas(buffer, pagesize=A4)
+        font = self.get_font()
+        _, height = A4
+        y = height - self.margin
+
+        def write_line(text, indent=0):
+            nonlocal y
+            if y < self.margin:
+                pdf.showPage()
+                y = height - self.margin
+            pdf.setFont(font, self.font_size)
+            pdf.drawString(self.margin + indent, y, text)
+            y -= self.line_height
+
+        write_line(f'{CART_TITLE}:')
+        for unit, items in group_by_unit(ingredients):
+            write_line(f'{unit}:')
+            for name, amount in items:
+                write_line(f'- {name}: {amount}', indent=15)
+        pdf.save()
+
+        buffer.seek(0)
+        while chunk := buffer.read(CHUNK_SIZE):
+            yield chunk
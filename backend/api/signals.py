@@ -0,0 +1,138 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from foodgram_backend.images import (
+    needs_processing,
+    schedule_processing,
+)
+from profiles.models import Follow, User
+from recipes.models import (
+    CatalogVersion,
+    Favorite,
+    Ingredient,
+    IngredientInRecipe,
+    Recipe,
+    ShoppingCart,
+)
+from .paginations import bump_count_version
+from .utils import (
+    RELATION_COUNTERS,
+    bump_recipe_cache_version,
+    delete_cached_recipe_author,
+    delete_cached_recipes,
+    touch_recipes,
+    update_relation_counter,
+)
+
+
+AUTHOR_FIELDS = {'username', 'first_name', 'last_name', 'email', 'avatar'}
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def bump_catalog_version(**kwargs):
+    CatalogVersion.bump()
+    bump_recipe_cache_version()
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def invalidate_recipe_cache(instance, **kwargs):
+    # Deferred until commit so ingredient rows written after save() are
+    # not cached half-updated.
+    transaction.on_commit(partial(delete_cached_recipes, [instance.pk]))
+
+
+@receiver(post_save, sender=User)
+def invalidate_recipe_author_cache(instance, **kwargs):
+    transaction.on_commit(partial(delete_cached_recipe_author, instance.pk))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=User)
+def process_uploaded_image(instance, **kwargs):
+    if needs_processing(instance):
+        schedule_processing(instance)
+
+
+@receiver(post_save, sender=Ingredient)
+def touch_ingredient_recipes(instance, created, **kwargs):
+    if not created:
+        Recipe.objects.filter(
+            ingredient_amounts__ingredient=instance,
+        ).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=IngredientInRecipe)
+def touch_ingredient_amount_recipe(instance, **kwargs):
+    # RecipeCreateSerializer writes rows in bulk; this covers the admin.
+    touch_recipes([instance.recipe_id])
+
+
+@receiver(post_save, sender=User)
+def touch_author_recipes(instance, created, update_fields, **kwargs):
+    # Recipe responses embed the author, so profile edits must change
+    # their validators; last_login updates on sign-in do not.
+    if created or (update_fields and AUTHOR_FIELDS.isdisjoint(update_fields)):
+        return
+    recipes = Recipe.objects.filter(author=instance)
+    recipe_ids = list(recipes.values_list('pk', flat=True))
+    recipes.update(updated_at=timezone.now())
+    transaction.on_commit(partial(delete_cached_recipes, recipe_ids))
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+@receiver([post_save, post_delete], sender=User)
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Follow)
+def invalidate_pagination_counts(update_fields=None, **kwargs):
+    # Relation deletes bump the version in the views: a post_delete
+    # receiver would turn their single DELETE into SELECT + DELETE.
+    # Sign-ins only save last_login and cannot change any count.
+    if update_fields and update_fields <= {'last_login'}:
+        return
+    bump_count_version()
+
+
+@receiver(post_save, sender=Recipe)
+def increment_recipes_count(instance, created, **kwargs):
+    if created:
+        User.objects.filter(pk=instance.author_id).update(
+            recipes_count=F('recipes_count') + 1,
+        )
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Follow)
+def increment_relation_count(sender, instance, created, raw, **kwargs):
+    # Fixtures load rows in any order, recount repairs them afterwards.
+    if created and not raw:
+        field = RELATION_COUNTERS[sender][0]
+        update_relation_counter(
+            sender, [getattr(instance, f'{field}_id')], 1,
+        )
+
+
+@receiver(pre_delete, sender=User)
+def decrement_relation_counts(instance, **kwargs):
+    # The cascade deletes the user's favorites, carts and follows without
+    # going through delete_relation.
+    for model, (field, _) in RELATION_COUNTERS.items():
+        update_relation_counter(
+            model,
+            model.objects.filter(user=instance).values(f'{field}_id'),
+            -1,
+        )
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(instance, **kwargs):
+    User.objects.filter(pk=instance.author_id).update(
+        recipes_count=Greatest(F('recipes_count') - 1, 0),
+    )
@@ -0,0 +1,1407 @@
+import base64
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipIf
+
+from django.contrib.auth.models import update_last_login
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from PIL import Image, ImageCms, PngImagePlugin
+from rest_framework import serializers, status
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from foodgram_backend.image_field import (
+    DECODE_CHUNK_SIZE,
+    MAX_IMAGE_SIZE,
+    Base64ImageField,
+)
+from profiles.models import Follow, User
+from api.paginations import get_count_version
+from api.utils import bulk_create_relations, search_ingredients
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    IngredientInRecipe,
+    Recipe,
+    RecipeScore,
+    ShoppingCart,
+)
+from recipes.serializers import RecipeCreateSerializer
+
+
+def create_user(username):
+    return User.objects.create(
+        email=f'{username}@example.com',
+        username=username,
+        first_name=username,
+        last_name=username,
+    )
+
+
+def get_statements(queries):
+    # The test transaction turns atomic() blocks into savepoints.
+    return [
+        query['sql'] for query in queries.captured_queries
+        if 'SAVEPOINT' not in query['sql']
+    ]
+
+
+def create_recipe(author, ingredients, name='Рецепт'):
+    recipe = Recipe.objects.create(
+        author=author,
+        name=name,
+        image='recipes/test.png',
+        # Already processed, so executed on-commit callbacks skip it.
+        image_variants={'source': 'recipes/test.png', 'variants': {}},
+        text='Описание',
+        cooking_time=10,
+    )
+    IngredientInRecipe.objects.bulk_create([
+        IngredientInRecipe(recipe=recipe, ingredient=ingredient, amount=amount)
+        for ingredient, amount in ingredients
+    ])
+    return recipe
+
+
+class ShoppingCartDownloadTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('cook')
+        cls.flour = Ingredient.objects.create(
+            name='мука', measurement_unit='г',
+        )
+        cls.milk = Ingredient.objects.create(
+            name='молоко', measurement_unit='мл',
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('api:recipe-download-shopping-cart')
+
+    def add_recipes_to_cart(self, count):
+        for _ in range(count):
+            recipe = create_recipe(
+                self.user, [(self.flour, 100), (self.milk, 50)],
+            )
+            ShoppingCart.objects.create(user=self.user, recipe=recipe)
+
+    def test_empty_cart(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_errors_are_json(self):
+        self.client.force_authenticate(None)
+        for params in [{}, {'format': 'csv'}, {'format': 'pdf'}]:
+            with self.subTest(params=params):
+                response = self.client.get(self.url, params)
+                self.assertEqual(response.status_code,
+                                 status.HTTP_401_UNAUTHORIZED)
+                self.assertEqual(response['Content-Type'], 'application/json')
+                self.assertIn('detail', response.json())
+
+    def test_amounts_are_summed(self):
+        self.add_recipes_to_cart(3)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = b''.join(response.streaming_content).decode()
+        self.assertIn('г:\n- мука: 300', content)
+        self.assertIn('мл:\n- молоко: 150', content)
+
+    def test_csv_format(self):
+        self.add_recipes_to_cart(2)
+        response = self.client.get(self.url, {'format': 'csv'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/csv'))
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(rows[1:], ['мука,г,200', 'молоко,мл,100'])
+
+    def test_pdf_format(self):
+        self.add_recipes_to_cart(2)
+        response = self.client.get(self.url, {'format': 'pdf'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        content = b''.join(response.streaming_content)
+        self.assertTrue(content.startswith(b'%PDF'))
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        self.add_recipes_to_cart(1)
+        with self.assertNumQueries(1):
+            b''.join(self.client.get(self.url).streaming_content)
+
+        self.add_recipes_to_cart(50)
+        with self.assertNumQueries(1):
+            b''.join(self.client.get(self.url).streaming_content)
+
+
+class RecipeListQueriesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'ингредиент {index}',
+                                      measurement_unit='г')
+            for index in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('api:recipe-list')
+
+    def add_recipes(self, count):
+        for index in range(count):
+            author = create_user(f'author{Recipe.objects.count()}')
+            Follow.objects.create(user=self.user, following=author)
+            create_recipe(
+                author,
+                [(ingredient, 10) for ingredient in self.ingredients],
+                name=f'Рецепт {index}',
+            )
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries)
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        self.add_recipes(1)
+        single = self.count_queries()
+        self.add_recipes(9)
+        self.assertEqual(self.count_queries(), single)
+
+    def test_nested_data(self):
+        self.add_recipes(1)
+        recipe = self.client.get(self.url).data['results'][0]
+        self.assertTrue(recipe['author']['is_subscribed'])
+        self.assertEqual(len(recipe['ingredients']), len(self.ingredients))
+
+    def test_favorite_and_cart_flags(self):
+        self.add_recipes(2)
+        favorite, in_cart = Recipe.objects.all()
+        Favorite.objects.create(user=self.user, recipe=favorite)
+        ShoppingCart.objects.create(user=self.user, recipe=in_cart)
+
+        results = {
+            recipe['id']: recipe
+            for recipe in self.client.get(self.url).data['results']
+        }
+        self.assertTrue(results[favorite.id]['is_favorited'])
+        self.assertFalse(results[favorite.id]['is_in_shopping_cart'])
+        self.assertFalse(results[in_cart.id]['is_favorited'])
+        self.assertTrue(results[in_cart.id]['is_in_shopping_cart'])
+
+        detail = self.client.get(
+            reverse('api:recipe-detail', args=[favorite.id])
+        ).data
+        self.assertTrue(detail['is_favorited'])
+
+        self.client.force_authenticate(None)
+        recipe = self.client.get(self.url).data['results'][0]
+        self.assertFalse(recipe['is_favorited'])
+        self.assertFalse(recipe['is_in_shopping_cart'])
+
+
+class SubscriptionStatusQueriesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('follower')
+        cls.ingredient = Ingredient.objects.create(
+            name='соль', measurement_unit='г',
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_authors(self, count, follow=True, recipes=1):
+        for _ in range(count):
+            author = create_user(f'author{User.objects.count()}')
+            for _ in range(recipes):
+                create_recipe(author, [(self.ingredient, 1)])
+            if follow:
+                Follow.objects.create(user=self.user, following=author)
+
+    def test_users_list_query_count(self):
+        self.add_authors(3)
+        self.add_authors(3, follow=False)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('api:user-list'))
+        subscribed = [
+            user['is_subscribed'] for user in response.data['results']
+        ]
+        self.assertEqual(subscribed.count(True), 3)
+
+    def test_subscriptions_do_not_query_follows_per_author(self):
+        self.add_authors(5)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('api:user-subscriptions'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(all(
+            user['is_subscribed'] for user in response.data['results']
+        ))
+        follow_queries = [
+            query for query in queries.captured_queries
+            if 'profiles_follow' in query['sql']
+        ]
+        self.assertEqual(len(follow_queries), 2)
+
+    def test_subscriptions_query_count(self):
+        url = reverse('api:user-subscriptions')
+        self.add_authors(1, recipes=4)
+        with self.assertNumQueries(3):
+            self.client.get(url, {'recipes_limit': 2})
+
+        self.add_authors(5, recipes=4)
+        with self.assertNumQueries(3):
+            response = self.client.get(url, {'recipes_limit': 2})
+        for author in response.data['results']:
+            self.assertEqual(len(author['recipes']), 2)
+            self.assertEqual(author['recipes_count'], 4)
+
+    def test_subscriptions_recipes_are_latest(self):
+        self.add_authors(1, recipes=3)
+        author = self.client.get(
+            reverse('api:user-subscriptions'), {'recipes_limit': 1},
+        ).data['results'][0]
+        latest = Recipe.objects.filter(author_id=author['id']).first()
+        self.assertEqual(author['recipes'][0]['id'], latest.id)
+
+
+@override_settings(INGREDIENT_AUTOCOMPLETE_LIMIT=3)
+class IngredientSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in ['сахар', 'сахарная пудра', 'ванильный сахар', 'соль']:
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def setUp(self):
+        search_ingredients.cache_clear()
+        self.url = reverse('api:ingredient-list')
+
+    def names(self, params):
+        response = self.client.get(self.url, params)
+        return [item['name'] for item in response.data]
+
+    def test_prefix_search(self):
+        self.assertEqual(
+            self.names({'name': 'Сах'}), ['сахар', 'сахарная пудра'],
+        )
+
+    def test_autocomplete_ranks_prefix_matches_first(self):
+        Ingredient.objects.create(name='тростниковый сахар',
+                                  measurement_unit='г')
+        self.assertEqual(
+            self.names({'name': 'сах', 'autocomplete': 'true'}),
+            ['сахар', 'сахарная пудра', 'ванильный сахар'],
+        )
+
+    def test_results_are_cached_until_ingredients_change(self):
+        self.names({'name': 'соль'})
+        with self.assertNumQueries(1):
+            self.assertEqual(self.names({'name': ' СОЛЬ '}), ['соль'])
+
+        Ingredient.objects.create(name='соль морская', measurement_unit='г')
+        self.assertEqual(
+            self.names({'name': 'соль'}), ['соль', 'соль морская'],
+        )
+
+    def test_catalog_conditional_get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()), 4)
+        self.assertIn('public', response['Cache-Control'])
+        etag = response['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(
+            self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'],
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Ingredient.objects.filter(name='соль').get().delete()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.json()), 3)
+
+
+class KeysetPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('scroller')
+        ingredient = Ingredient.objects.create(
+            name='вода', measurement_unit='мл',
+        )
+        for index in range(7):
+            create_recipe(cls.user, [(ingredient, 1)], name=f'Рецепт {index}')
+        same_time = Recipe.objects.order_by('id')[3].pub_date
+        Recipe.objects.filter(id__in=Recipe.objects.order_by('id')
+                              .values('id')[:4]).update(pub_date=same_time)
+        cls.expected = list(
+            Recipe.objects.order_by('-pub_date', '-id')
+            .values_list('id', flat=True)
+        )
+
+    def setUp(self):
+        self.url = reverse('api:recipe-list')
+
+    def walk(self, url, key):
+        ids = []
+        while url:
+            data = self.client.get(url).data
+            self.assertIsNone(data['count'])
+            page = [recipe['id'] for recipe in data['results']]
+            ids = ids + page if key == 'next' else page + ids
+            url = data[key]
+        return ids
+
+    def test_forward_and_backward(self):
+        self.assertEqual(self.walk(f'{self.url}?cursor=&limit=3', 'next'),
+                         self.expected)
+
+        last_page = self.client.get(self.url, {'cursor': '', 'limit': 3})
+        while last_page.data['next']:
+            last_page = self.client.get(last_page.data['next'])
+        self.assertEqual(
+            self.walk(last_page.data['previous'], 'previous')
+            + [recipe['id'] for recipe in last_page.data['results']],
+            self.expected,
+        )
+
+    def test_page_number_pagination_is_default(self):
+        data = self.client.get(self.url, {'limit': 3}).data
+        self.assertEqual(data['count'], len(self.expected))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CachedCountTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('counter')
+        cls.ingredient = Ingredient.objects.create(
+            name='перец', measurement_unit='г',
+        )
+        create_recipe(cls.user, [(cls.ingredient, 1)])
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('api:recipe-list')
+
+    def test_count_is_cached_and_invalidated(self):
+        with CaptureQueriesContext(connection) as first:
+            self.assertEqual(self.client.get(self.url).data['count'], 1)
+        with CaptureQueriesContext(connection) as second:
+            self.assertEqual(self.client.get(self.url).data['count'], 1)
+        self.assertEqual(len(second), len(first) - 1)
+
+        create_recipe(self.user, [(self.ingredient, 1)])
+        self.assertEqual(self.client.get(self.url).data['count'], 2)
+
+    def test_count_is_cached_per_filter(self):
+        self.client.get(self.url)
+        other = create_user('other')
+        data = self.client.get(self.url, {'author': other.id}).data
+        self.assertEqual(data['count'], 0)
+
+    def test_sign_in_keeps_cached_counts(self):
+        version = get_count_version()
+        update_last_login(None, self.user)
+        self.assertEqual(get_count_version(), version)
+        self.user.first_name = 'Переименован'
+        self.user.save()
+        self.assertNotEqual(get_count_version(), version)
+
+    def test_keyset_page_skips_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(self.url, {'cursor': ''}).data
+        self.assertIsNone(data['count'])
+        self.assertEqual(len(data['results']), 1)
+        self.assertFalse(any(
+            'COUNT(' in query['sql'] for query in queries
+        ))
+
+
+class RelationToggleTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('toggler')
+        cls.author = create_user('toggled')
+        cls.recipe = create_recipe(cls.author, [])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_favorite_toggle(self):
+        url = reverse('api:recipe-favorite', args=[self.recipe.id])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(get_statements(queries)), 3)
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(len(get_statements(queries)), 3)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_subscribe_toggle(self):
+        url = reverse('api:user-subscribe', args=[self.author.id])
+        self.assertEqual(self.client.post(url).status_code,
+                         status.HTTP_201_CREATED)
+        self.assertEqual(self.client.post(url).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.delete(url).status_code,
+                         status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.delete(url).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+        url = reverse('api:user-subscribe', args=[self.user.id])
+        self.assertEqual(self.client.post(url).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+
+@skipIf(connection.vendor == 'sqlite',
+        'SQLite блокирует всю таблицу при параллельной записи')
+class ConcurrentToggleTests(TransactionTestCase):
+
+    def test_concurrent_add_to_cart(self):
+        user = create_user('clicker')
+        recipe = create_recipe(create_user('chef'), [])
+        url = reverse('api:recipe-shopping-cart', args=[recipe.id])
+        barrier = threading.Barrier(5)
+        statuses = []
+
+        def click():
+            client = APIClient()
+            client.force_authenticate(user)
+            barrier.wait()
+            try:
+                statuses.append(client.post(url).status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=click) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(statuses.count(status.HTTP_201_CREATED), 1)
+        self.assertEqual(statuses.count(status.HTTP_400_BAD_REQUEST), 4)
+        self.assertEqual(
+            ShoppingCart.objects.filter(user=user, recipe=recipe).count(), 1,
+        )
+
+
+class BulkRelationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('planner')
+        cls.author = create_user('planned')
+        cls.recipes = [create_recipe(cls.author, []) for _ in range(3)]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_bulk_shopping_cart(self):
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipes[0])
+        ids = [recipe.id for recipe in self.recipes]
+        missing_id = max(ids) + 1
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse('api:recipe-shopping-cart-bulk'),
+                {'ids': ids + [missing_id, ids[1]]},
+                format='json',
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(get_statements(queries)), 4)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['exists', 'created', 'created', 'not_found'],
+        )
+        self.assertEqual(
+            ShoppingCart.objects.filter(user=self.user).count(), 3,
+        )
+        self.assertEqual(
+            list(Recipe.objects.order_by('id')
+                 .values_list('shopping_cart_count', flat=True)),
+            [1, 1, 1],
+        )
+
+    def test_bulk_favorite_requires_ids(self):
+        response = self.client.post(
+            reverse('api:recipe-favorite-bulk'), {'ids': []}, format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_subscribe(self):
+        response = self.client.post(
+            reverse('api:user-subscribe-bulk'),
+            {'ids': [self.author.id, self.user.id]},
+            format='json',
+        )
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['created', 'invalid'],
+        )
+        self.assertTrue(
+            Follow.objects.filter(user=self.user, following=self.author)
+            .exists()
+        )
+
+
+class CounterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('counter')
+        cls.author = create_user('counted')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_recipes_count(self):
+        recipe = create_recipe(self.author, [])
+        create_recipe(self.author, [])
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 2)
+        recipe.delete()
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 1)
+
+    def test_followers_count(self):
+        url = reverse('api:user-subscribe', args=[self.author.id])
+        self.client.post(url)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 1)
+        response = self.client.get(reverse('api:user-subscriptions'))
+        self.assertEqual(response.data['results'][0]['recipes_count'], 0)
+        self.client.delete(url)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 0)
+
+    def test_recount_repairs_drift(self):
+        recipe = create_recipe(self.author, [])
+        Favorite.objects.bulk_create([Favorite(user=self.user, recipe=recipe)])
+        User.objects.filter(pk=self.author.pk).update(recipes_count=5)
+        call_command('recount', stdout=StringIO())
+        recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+        self.assertEqual(self.author.recipes_count, 1)
+
+    def test_save_keeps_concurrent_increments(self):
+        recipe = create_recipe(self.author, [])
+        author = User.objects.get(pk=self.author.pk)
+        stale = Recipe.objects.get(pk=recipe.pk)
+        self.client.post(reverse('api:recipe-favorite', args=[recipe.id]))
+        self.client.post(reverse('api:user-subscribe', args=[author.id]))
+        stale.name = 'Переименован'
+        stale.save()
+        author.first_name = 'Переименован'
+        author.save()
+        recipe.refresh_from_db()
+        author.refresh_from_db()
+        self.assertEqual(recipe.name, 'Переименован')
+        self.assertEqual(recipe.favorites_count, 1)
+        self.assertEqual(author.first_name, 'Переименован')
+        self.assertEqual(author.followers_count, 1)
+        self.assertEqual(author.recipes_count, 1)
+
+    def test_user_delete_releases_counters(self):
+        recipe = create_recipe(self.author, [])
+        Favorite.objects.create(user=self.user, recipe=recipe)
+        ShoppingCart.objects.create(user=self.user, recipe=recipe)
+        Follow.objects.create(user=self.user, following=self.author)
+        User.objects.filter(pk=self.author.pk).update(followers_count=1)
+        Recipe.objects.filter(pk=recipe.pk).update(
+            favorites_count=1, shopping_cart_count=1,
+        )
+        self.user.delete()
+        recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 0)
+        self.assertEqual(recipe.shopping_cart_count, 0)
+        self.assertEqual(self.author.followers_count, 0)
+
+    def test_direct_and_admin_changes(self):
+        recipe, other = [create_recipe(self.author, []) for _ in range(2)]
+        favorite = Favorite.objects.create(user=self.user, recipe=recipe)
+        Follow.objects.create(user=self.user, following=self.author)
+        recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+        self.assertEqual(self.author.followers_count, 1)
+
+        admin_user = User.objects.create_superuser(
+            email='admin@example.com', username='admin', password='admin',
+        )
+        self.client.force_login(admin_user)
+        self.client.post(
+            reverse('admin:recipes_favorite_change', args=[favorite.id]),
+            {'user': self.user.id, 'recipe': other.id},
+        )
+        self.client.post(reverse('admin:profiles_follow_changelist'), {
+            'action': 'delete_selected',
+            '_selected_action': list(
+                Follow.objects.values_list('id', flat=True)
+            ),
+            'post': 'yes',
+        })
+        self.client.post(
+            reverse('admin:recipes_favorite_delete', args=[favorite.id]),
+            {'post': 'yes'},
+        )
+        self.assertEqual(
+            list(Recipe.objects.filter(pk__in=[recipe.pk, other.pk])
+                 .order_by('pk').values_list('favorites_count', flat=True)),
+            [0, 0],
+        )
+        self.assertFalse(Favorite.objects.exists())
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 0)
+
+    def test_bulk_create_counts_only_inserted_rows(self):
+        recipes = [create_recipe(self.author, []) for _ in range(2)]
+        Favorite.objects.create(user=self.user, recipe=recipes[0])
+        Recipe.objects.filter(pk=recipes[0].pk).update(favorites_count=1)
+        ids = [recipe.id for recipe in recipes]
+        # The existence check misses a row added by a concurrent request.
+        with mock.patch('api.utils.get_bulk_outcome',
+                        return_value='created'):
+            results = bulk_create_relations(
+                Favorite, self.user, 'recipe', ids, set(ids),
+            )['results']
+        self.assertEqual(
+            [result['status'] for result in results], ['exists', 'created'],
+        )
+        self.assertEqual(
+            list(Recipe.objects.filter(pk__in=ids).order_by('pk')
+                 .values_list('favorites_count', flat=True)),
+            [1, 1],
+        )
+
+
+class RecipeScoreOrderingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('ranked')
+        users = [create_user(f'ranker{index}') for index in range(4)]
+        cls.old, cls.fresh, cls.plain = [
+            create_recipe(author, [], name=name)
+            for name in ['Старый', 'Свежий', 'Обычный']
+        ]
+        Favorite.objects.bulk_create([
+            Favorite(
+                user=user,
+                recipe=cls.old,
+                created_at=timezone.now() - timedelta(days=20),
+            )
+            for user in users
+        ])
+        Favorite.objects.create(user=users[0], recipe=cls.fresh)
+        ShoppingCart.objects.create(user=users[0], recipe=cls.fresh)
+        call_command('recount', stdout=StringIO())
+        call_command('refresh_recipe_scores', batch_size=2, stdout=StringIO())
+        cls.unscored = create_recipe(author, [], name='Новый')
+
+    def get_ids(self, ordering):
+        response = self.client.get(
+            reverse('api:recipe-list'), {'ordering': ordering},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_popular(self):
+        self.assertEqual(
+            self.get_ids('popular'),
+            [self.old.id, self.fresh.id, self.plain.id, self.unscored.id],
+        )
+
+    def test_trending(self):
+        self.assertEqual(
+            self.get_ids('trending'),
+            [self.fresh.id, self.old.id, self.plain.id, self.unscored.id],
+        )
+
+    def test_refresh_updates_scores(self):
+        Favorite.objects.filter(recipe=self.old).delete()
+        call_command('recount', stdout=StringIO())
+        call_command('refresh_recipe_scores', stdout=StringIO())
+        self.assertEqual(
+            RecipeScore.objects.get(recipe=self.old).popular, 0,
+        )
+        self.assertEqual(RecipeScore.objects.count(), 4)
+
+    def test_refresh_changes_etag(self):
+        url = reverse('api:recipe-list')
+        response = self.client.get(url, {'ordering': 'popular'})
+        Favorite.objects.filter(recipe=self.old).delete()
+        call_command('recount', stdout=StringIO())
+        call_command('refresh_recipe_scores', stdout=StringIO())
+        response = self.client.get(
+            url, {'ordering': 'popular'}, HTTP_IF_NONE_MATCH=response['ETag'],
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['id'], self.fresh.id)
+
+    def test_unknown_ordering(self):
+        response = self.client.get(
+            reverse('api:recipe-list'), {'ordering': 'random'},
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RecipeCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('cached_reader')
+        cls.author = create_user('cached_author')
+        cls.ingredient = Ingredient.objects.create(
+            name='мука', measurement_unit='г',
+        )
+        cls.recipe = create_recipe(cls.author, [(cls.ingredient, 200)])
+        Follow.objects.create(user=cls.user, following=cls.author)
+        Favorite.objects.create(user=cls.user, recipe=cls.recipe)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('api:recipe-detail', args=[self.recipe.id])
+
+    def test_matches_serializer_output(self):
+        expected = self.client.get(reverse('api:recipe-list')).data
+        self.client.get(self.url)
+        self.assertEqual(self.client.get(self.url).data,
+                         expected['results'][0])
+
+    def test_cached_queries(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(1):
+            data = self.client.get(self.url).data
+        self.assertTrue(data['is_favorited'])
+        self.assertFalse(data['is_in_shopping_cart'])
+        self.assertTrue(data['author']['is_subscribed'])
+
+        self.client.force_authenticate(None)
+        with self.assertNumQueries(0):
+            data = self.client.get(self.url).data
+        self.assertFalse(data['is_favorited'])
+        self.assertFalse(data['author']['is_subscribed'])
+
+    def test_missing_recipe(self):
+        for recipe_id in [self.recipe.id + 1, 'abc']:
+            response = self.client.get(f'{reverse("api:recipe-list")}'
+                                       f'{recipe_id}/')
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_recipe_update_invalidates(self):
+        self.client.get(self.url)
+        self.client.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(self.url, {
+                'name': 'Новое название',
+                'ingredients': [{'id': self.ingredient.id, 'amount': 300}],
+            }, format='json')
+        data = self.client.get(self.url).data
+        self.assertEqual(data['name'], 'Новое название')
+        self.assertEqual(data['ingredients'][0]['amount'], 300)
+
+    def test_ingredient_amount_changes_invalidate(self):
+        etag = self.client.get(self.url)['ETag']
+        row = IngredientInRecipe.objects.get(recipe=self.recipe)
+        with self.captureOnCommitCallbacks(execute=True):
+            row.amount = 250
+            row.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['ingredients'][0]['amount'], 250)
+
+        admin_user = User.objects.create_superuser(
+            email='admin@example.com', username='admin', password='admin',
+        )
+        self.client.force_login(admin_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse('admin:recipes_ingredientinrecipe_delete',
+                        args=[row.id]),
+                {'post': 'yes'},
+            )
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get(self.url).data['ingredients'], [])
+
+    def test_author_and_ingredient_changes_invalidate(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.first_name = 'Переименован'
+            self.author.save()
+        self.ingredient.name = 'мука пшеничная'
+        self.ingredient.save()
+        data = self.client.get(self.url).data
+        self.assertEqual(data['author']['first_name'], 'Переименован')
+        self.assertEqual(data['ingredients'][0]['name'], 'мука пшеничная')
+
+
+class ConditionalRecipeTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('revalidator')
+        cls.author = create_user('revalidated')
+        cls.recipes = [create_recipe(cls.author, []) for _ in range(2)]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.list_url = reverse('api:recipe-list')
+        self.detail_url = reverse(
+            'api:recipe-detail', args=[self.recipes[0].id],
+        )
+
+    def revalidate(self, url, response, **params):
+        return self.client.get(
+            url, params, HTTP_IF_NONE_MATCH=response['ETag'],
+        )
+
+    def test_detail_not_modified(self):
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Last-Modified', response)
+        self.assertIn('private', response['Cache-Control'])
+
+        with self.assertNumQueries(1):
+            revalidated = self.revalidate(self.detail_url, response)
+        self.assertEqual(revalidated.status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(revalidated['ETag'], response['ETag'])
+
+        Favorite.objects.create(user=self.user, recipe=self.recipes[0])
+        self.assertEqual(
+            self.revalidate(self.detail_url, response).status_code,
+            status.HTTP_200_OK,
+        )
+
+    def test_detail_changes_on_update(self):
+        response = self.client.get(self.detail_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipes[0].name = 'Обновлен'
+            self.recipes[0].save()
+        self.assertEqual(
+            self.revalidate(self.detail_url, response).status_code,
+            status.HTTP_200_OK,
+        )
+
+    def test_list_not_modified(self):
+        response = self.client.get(self.list_url)
+        with self.assertNumQueries(2):
+            revalidated = self.revalidate(self.list_url, response)
+        self.assertEqual(revalidated.status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(
+            self.revalidate(self.list_url, response, limit=1).status_code,
+            status.HTTP_200_OK,
+        )
+
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipes[1])
+        response = self.revalidate(self.list_url, response)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.recipes[1].delete()
+        self.assertEqual(
+            self.revalidate(self.list_url, response).status_code,
+            status.HTTP_200_OK,
+        )
+
+    def test_if_modified_since_is_ignored(self):
+        for url in [self.detail_url, f'{self.list_url}?is_favorited=1']:
+            with self.subTest(url=url):
+                self.client.get(url)
+                Favorite.objects.get_or_create(
+                    user=self.user, recipe=self.recipes[0],
+                )
+                response = self.client.get(
+                    url, HTTP_IF_MODIFIED_SINCE=http_date(),
+                )
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertTrue(response.data)
+
+    def test_author_profile_change(self):
+        response = self.client.get(self.list_url)
+        self.author.first_name = 'Новое имя'
+        self.author.save()
+        self.assertEqual(
+            self.revalidate(self.list_url, response).status_code,
+            status.HTTP_200_OK,
+        )
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def encode_image(size, image_format='JPEG', mode='RGB', exif=None):
+    buffer = BytesIO()
+    options = {'exif': exif} if exif is not None else {}
+    Image.new(mode, size, 'red').save(buffer, image_format, **options)
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    return f'data:image/{image_format.lower()};base64,{encoded}'
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_PROCESSING_WORKERS=0)
+class ImagePipelineTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('photographer')
+        cls.ingredient = Ingredient.objects.create(
+            name='соль', measurement_unit='г',
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_recipe(self, image):
+        return self.client.post(reverse('api:recipe-list'), {
+            'name': 'Фото',
+            'text': 'Описание',
+            'cooking_time': 5,
+            'image': image,
+            'ingredients': [{'id': self.ingredient.id, 'amount': 1}],
+        }, format='json')
+
+    def test_recipe_variants(self):
+        exif = Image.Exif()
+        exif[0x010e] = 'секретное описание'
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.create_recipe(
+                encode_image((1600, 900), exif=exif),
+            )
+            with Image.open(Recipe.objects.get().image.path) as original:
+                self.assertEqual(len(callbacks), 0)
+                self.assertFalse(original.getexif())
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        recipe = Recipe.objects.get()
+        self.assertEqual(recipe.image_variants['source'], recipe.image.name)
+        variants = recipe.image_variants['variants']
+        for name, width in [('card', 480), ('detail', 1200)]:
+            self.assertEqual(set(variants[name]), {'webp', 'jpeg'})
+            with recipe.image.storage.open(variants[name]['webp']) as file:
+                self.assertEqual(Image.open(file).size[0], width)
+
+        data = self.client.get(
+            reverse('api:recipe-detail', args=[recipe.id])
+        ).data
+        self.assertTrue(
+            data['image_variants']['card']['webp'].startswith('http://')
+        )
+        self.assertEqual(data['image'].rsplit('/', 1)[-1],
+                         recipe.image.name.rsplit('/', 1)[-1])
+
+    def test_invalid_images_rejected(self):
+        garbage = base64.b64encode(b'not an image').decode()
+        for image in [
+            f'data:image/png;base64,{garbage}',
+            'data:image/png;base64,@@@',
+            'data:image/png',
+        ]:
+            response = self.create_recipe(image)
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+
+    def test_avatar_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(
+                reverse('api:user-avatar'),
+                {'avatar': encode_image((64, 64), 'PNG', 'RGBA')},
+                format='json',
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        data = self.client.get(reverse('api:user-me')).data
+        self.assertEqual(set(data['avatar_variants']), {'avatar'})
+
+
+class Base64ImageFieldTests(TestCase):
+
+    def test_chunked_decode(self):
+        buffer = BytesIO()
+        Image.frombytes('L', (300, 300), os.urandom(300 * 300)).save(
+            buffer, 'PNG',
+        )
+        encoded = base64.b64encode(buffer.getvalue()).decode()
+        self.assertGreater(len(encoded), DECODE_CHUNK_SIZE)
+        file = Base64ImageField().to_internal_value(
+            f'data:image/png;base64,{encoded}'
+        )
+        self.assertTrue(file.name.endswith('.png'))
+        self.assertEqual(file.read(), buffer.getvalue())
+
+    def test_metadata_stripped(self):
+        icc_profile = ImageCms.ImageCmsProfile(
+            ImageCms.createProfile('sRGB'),
+        ).tobytes()
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        pnginfo = PngImagePlugin.PngInfo()
+        pnginfo.add_text('Comment', 'секрет')
+        for image_format, options in [
+            ('JPEG', {'exif': exif, 'xmp': b'<x/>', 'comment': b'c'}),
+            ('PNG', {'pnginfo': pnginfo, 'icc_profile': icc_profile}),
+            ('WEBP', {'icc_profile': icc_profile, 'xmp': b'<x/>'}),
+            ('GIF', {'comment': b'c'}),
+        ]:
+            with self.subTest(image_format):
+                buffer = BytesIO()
+                Image.new('RGB', (40, 20), 'red').save(
+                    buffer, image_format, **options,
+                )
+                encoded = base64.b64encode(buffer.getvalue()).decode()
+                file = Base64ImageField().to_internal_value(
+                    f'data:image/{image_format.lower()};base64,{encoded}'
+                )
+                content = file.read()
+                self.assertIn(hashlib.sha256(content).hexdigest(), file.name)
+                with Image.open(BytesIO(content)) as image:
+                    self.assertFalse(image.getexif())
+                    self.assertFalse(
+                        set(image.info) & {'comment', 'icc_profile', 'xmp'}
+                    )
+                    self.assertFalse(getattr(image, 'text', None))
+                    if image_format == 'JPEG':
+                        self.assertEqual(image.size, (20, 40))
+
+    def test_oversized_rejected_before_decoding(self):
+        encoded = 'A' * ((MAX_IMAGE_SIZE // 3 + 1) * 4)
+        with mock.patch('foodgram_backend.image_field.base64') as decoder:
+            with self.assertRaises(serializers.ValidationError):
+                Base64ImageField().to_internal_value(
+                    f'data:image/png;base64,{encoded}'
+                )
+        decoder.b64decode.assert_not_called()
+
+    def test_invalid_length(self):
+        with self.assertRaises(serializers.ValidationError):
+            Base64ImageField().to_internal_value('data:image/png;base64,AAA')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_PROCESSING_WORKERS=0)
+class ContentAddressedStorageTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('deduplicator')
+        cls.ingredient = Ingredient.objects.create(
+            name='сахар', measurement_unit='г',
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_recipe(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('api:recipe-list'), {
+                'name': 'Копия',
+                'text': 'Описание',
+                'cooking_time': 5,
+                'image': image,
+                'ingredients': [{'id': self.ingredient.id, 'amount': 1}],
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return Recipe.objects.get(id=response.data['id'])
+
+    def update_image(self, recipe, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(
+                reverse('api:recipe-detail', args=[recipe.id]),
+                {
+                    'image': image,
+                    'ingredients': [{'id': self.ingredient.id, 'amount': 1}],
+                },
+                format='json',
+            )
+        recipe.refresh_from_db()
+
+    def collect(self, **options):
+        call_command('gc_media', stdout=StringIO(), **options)
+
+    def test_identical_uploads_share_file(self):
+        image = encode_image((32, 32), 'PNG')
+        first = self.create_recipe(image)
+        second = self.create_recipe(image)
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(
+            first.image.name, r'^recipes/[0-9a-f]{2}/[0-9a-f]{64}\.png$',
+        )
+
+        old_name = first.image.name
+        old_variant = first.image_variants['variants']['card']['webp']
+        self.update_image(first, encode_image((48, 48), 'PNG'))
+        self.update_image(second, encode_image((48, 48), 'PNG'))
+        self.assertTrue(second.image.storage.exists(old_name))
+
+        self.collect(grace_minutes=0)
+        self.assertFalse(second.image.storage.exists(old_name))
+        self.assertFalse(second.image.storage.exists(old_variant))
+        self.assertTrue(second.image.storage.exists(second.image.name))
+
+    def test_reuse_of_released_file_survives_gc(self):
+        image = encode_image((40, 40), 'PNG')
+        recipe = self.create_recipe(image)
+        storage = recipe.image.storage
+        name = recipe.image.name
+        self.update_image(recipe, encode_image((56, 56), 'PNG'))
+        self.assertTrue(storage.exists(name))
+
+        stale = time.time() - 2 * 60 * 60
+        os.utime(storage.path(name), (stale, stale))
+        # An upload of the same content reuses the orphaned file before
+        # its transaction commits.
+        upload = Base64ImageField().to_internal_value(image)
+        self.assertEqual(storage.save(f'recipes/{upload.name}', upload), name)
+        self.collect()
+        self.assertTrue(storage.exists(name))
+
+        self.assertEqual(self.create_recipe(image).image.name, name)
+        self.assertTrue(storage.exists(name))
+
+    def test_delete_avatar_leaves_file_to_gc(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(
+                reverse('api:user-avatar'),
+                {'avatar': encode_image((16, 16), 'PNG')},
+                format='json',
+            )
+        self.user.refresh_from_db()
+        name = self.user.avatar.name
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('api:user-avatar'))
+        self.assertTrue(self.user.avatar.storage.exists(name))
+        self.collect(grace_minutes=0)
+        self.assertFalse(self.user.avatar.storage.exists(name))
+
+    def test_gc_media(self):
+        recipe = self.create_recipe(encode_image((24, 24), 'PNG'))
+        storage = recipe.image.storage
+        orphan = storage.save('recipes/orphan.png', BytesIO(b'orphan'))
+        call_command('gc_media', grace_minutes=0, dry_run=True,
+                     stdout=StringIO())
+        self.assertTrue(storage.exists(orphan))
+        call_command('gc_media', grace_minutes=0, stdout=StringIO())
+        self.assertFalse(storage.exists(orphan))
+        self.assertTrue(storage.exists(recipe.image.name))
+
+
+class RecipeIngredientUpdateTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('editor')
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'специя {index}',
+                                      measurement_unit='г')
+            for index in range(4)
+        ]
+        cls.recipe = create_recipe(
+            cls.author,
+            [(ingredient, 10) for ingredient in cls.ingredients[:3]],
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+        self.url = reverse('api:recipe-detail', args=[self.recipe.id])
+
+    def rows(self):
+        return {
+            row.ingredient_id: (row.id, row.amount)
+            for row in IngredientInRecipe.objects.filter(recipe=self.recipe)
+        }
+
+    def patch(self, amounts):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(self.url, {
+                'text': 'Исправленный текст',
+                'ingredients': [
+                    {'id': ingredient.id, 'amount': amount}
+                    for ingredient, amount in amounts
+                ],
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [
+            sql for sql in get_statements(queries)
+            if 'recipes_ingredientinrecipe' in sql
+            and not sql.startswith('SELECT')
+        ]
+
+    def test_text_only_update_keeps_rows(self):
+        before = self.rows()
+        writes = self.patch([(ingredient, 10)
+                             for ingredient in self.ingredients[:3]])
+        self.assertEqual(writes, [])
+        self.assertEqual(self.rows(), before)
+
+    def test_diff(self):
+        first, second, third, fourth = self.ingredients
+        before = self.rows()
+        writes = self.patch([(first, 10), (second, 25), (fourth, 5)])
+        self.assertEqual(
+            [sql.split()[0] for sql in writes], ['DELETE', 'UPDATE', 'INSERT'],
+        )
+        after = self.rows()
+        self.assertEqual(after[first.id], before[first.id])
+        self.assertEqual(after[second.id], (before[second.id][0], 25))
+        self.assertNotIn(third.id, after)
+        self.assertEqual(after[fourth.id][1], 5)
+
+    def stale_serializer(self):
+        request = APIRequestFactory().patch(self.url)
+        request.user = self.author
+        return RecipeCreateSerializer(
+            Recipe.objects.get(pk=self.recipe.pk),
+            data={
+                'text': 'Исправленный текст',
+                'ingredients': [{'id': self.ingredients[0].id, 'amount': 1}],
+            },
+            partial=True,
+            context={'request': Request(request)},
+        )
+
+    def test_update_applies_to_locked_row(self):
+        serializer = self.stale_serializer()
+        Recipe.objects.filter(pk=self.recipe.pk).update(cooking_time=99)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        recipe = serializer.save()
+        self.assertEqual(recipe.cooking_time, 99)
+        self.recipe.refresh_from_db()
+        self.assertEqual(
+            (self.recipe.text, self.recipe.cooking_time),
+            ('Исправленный текст', 99),
+        )
+
+    def test_update_of_deleted_recipe(self):
+        serializer = self.stale_serializer()
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        Recipe.objects.filter(pk=self.recipe.pk).delete()
+        with self.assertRaises(NotFound):
+            serializer.save()
+        self.assertFalse(Recipe.objects.exists())
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_PROCESSING_WORKERS=0)
+class RecipeCreateQueryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('batcher')
+        cls.ingredients = Ingredient.objects.bulk_create([
+            Ingredient(name=f'крупа {index}', measurement_unit='г')
+            for index in range(50)
+        ])
+        cls.image = encode_image((8, 8), 'PNG')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_recipe(self, ids):
+        return self.client.post(reverse('api:recipe-list'), {
+            'name': 'Каша',
+            'text': 'Описание',
+            'cooking_time': 15,
+            'image': self.image,
+            'ingredients': [{'id': pk, 'amount': 2} for pk in ids],
+        }, format='json')
+
+    def test_query_count_does_not_grow(self):
+        ids = [ingredient.id for ingredient in self.ingredients]
+        for count in [1, 10, 50]:
+            with self.subTest(count=count):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.create_recipe(ids[:count])
+                self.assertEqual(
+                    response.status_code, status.HTTP_201_CREATED,
+                )
+                self.assertEqual(len(response.data['ingredients']), count)
+                statements = get_statements(queries)
+                self.assertEqual(len(statements), 6)
+                self.assertEqual(sum(
+                    'FROM "recipes_ingredient"' in sql for sql in statements
+                ), 1)
+
+    def test_missing_ingredients_reported_together(self):
+        response = self.create_recipe([self.ingredients[0].id, 9998, 9999])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        error = str(response.data['ingredients'][0])
+        self.assertIn('9998', error)
+        self.assertIn('9999', error)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_create_is_atomic(self):
+        ids = [self.ingredients[0].id]
+        with mock.patch.object(
+            IngredientInRecipe.objects, 'bulk_create',
+            side_effect=DatabaseError,
+        ), self.assertRaises(DatabaseError):
+            self.create_recipe(ids)
+        self.assertFalse(Recipe.objects.exists())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.recipes_count, 0)
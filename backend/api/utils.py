@@ -1,22 +1,386 @@
-from collections import defaultdict
+import hashlib
+import json
+from functools import lru_cache, partial
+from itertools import groupby
+from operator import itemgetter
 
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import (
+    Case,
+    Count,
+    Exists,
+    F,
+    Max,
+    OuterRef,
+    Prefetch,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
 
-def generate_cart_text(items):
-    ingredients_total = defaultdict(lambda: {'amount': 0, 'unit': ''})
+from rest_framework.renderers import JSONRenderer
 
-    for item in items:
-        recipe = item.recipe
-        for ingredient in recipe.ingredient_amounts \
-                .select_related('ingredient'):
-            key = ingredient.ingredient.name
-            unit = ingredient.ingredient.measurement_unit
-            ingredients_total[key]['amount'] += ingredient.amount
-            ingredients_total[key]['unit'] = unit
+from foodgram_backend.images import absolutize_variant_urls
 
-    lines = ["Список покупок:\n"]
-    for name, data in sorted(ingredients_total.items()):
-        lines.append(f"- {name} ({data['unit']}): {data['amount']}")
+from profiles.models import Follow, User
+from profiles.serializers import UserSerializer
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    IngredientInRecipe,
+    Recipe,
+    ShoppingCart,
+)
+from recipes.serializers import IngredientSerializer, RecipeSerializer
+from .paginations import bump_count_version, get_count_version
 
-    cart_text = '\n'.join(lines)
 
-    return cart_text
+def get_cart_ingredients(user):
+    return (
+        IngredientInRecipe.objects
+        .filter(recipe__in_carts__user=user)
+        .values('ingredient__measurement_unit', 'ingredient__name')
+        .annotate(total_amount=Sum('amount'))
+        .order_by('ingredient__measurement_unit', 'ingredient__name')
+    )
+
+
+def group_by_unit(ingredients):
+    for unit, items in groupby(
+        ingredients,
+        key=itemgetter('ingredient__measurement_unit'),
+    ):
+        yield unit, (
+            (item['ingredient__name'], item['total_amount'])
+            for item in items
+        )
+
+
+def normalize_ingredient_query(name):
+    return ' '.join(name.split()).lower()
+
+
+@lru_cache(maxsize=1)
+def get_catalog_snapshot(version, updated_at):
+    content = JSONRenderer().render(
+        IngredientSerializer(Ingredient.objects.all(), many=True).data
+    )
+    etag = f'"ingredients-{version}-{int(updated_at.timestamp())}"'
+    return etag, content
+
+
+@lru_cache(maxsize=settings.INGREDIENT_SEARCH_CACHE_SIZE)
+def search_ingredients(name, autocomplete=False, version=None):
+    if not autocomplete:
+        ingredients = Ingredient.objects.filter(name__istartswith=name)
+    else:
+        ingredients = (
+            Ingredient.objects
+            .filter(name__icontains=name)
+            .annotate(rank=Case(
+                When(name__istartswith=name, then=Value(0)),
+                default=Value(1),
+            ))
+            .order_by('rank', 'name')
+            [:settings.INGREDIENT_AUTOCOMPLETE_LIMIT]
+        )
+    return tuple(IngredientSerializer(ingredients, many=True).data)
+
+
+RELATION_COUNTERS = {
+    Favorite: ('recipe', 'favorites_count'),
+    ShoppingCart: ('recipe', 'shopping_cart_count'),
+    Follow: ('following', 'followers_count'),
+}
+
+
+def update_relation_counter(model, target_ids, delta):
+    field, counter = RELATION_COUNTERS[model]
+    target_model = model._meta.get_field(field).related_model
+    target_model.objects.filter(pk__in=target_ids).update(
+        **{counter: Greatest(F(counter) + delta, 0)}
+    )
+
+
+def create_relation(model, **fields):
+    # The counter is incremented by the post_save receiver.
+    try:
+        with transaction.atomic():
+            model.objects.create(**fields)
+    except IntegrityError:
+        return False
+    return True
+
+
+def delete_relation(model, **fields):
+    target = fields[RELATION_COUNTERS[model][0]]
+    with transaction.atomic():
+        deleted, _ = model.objects.filter(**fields).delete()
+        if deleted:
+            update_relation_counter(model, [target.pk], -deleted)
+    if deleted:
+        bump_count_version()
+    return bool(deleted)
+
+
+def get_bulk_outcome(target_id, found_ids, existing_ids, invalid_ids):
+    if target_id in invalid_ids:
+        return 'invalid'
+    if target_id not in found_ids:
+        return 'not_found'
+    if target_id in existing_ids:
+        return 'exists'
+    return 'created'
+
+
+def bulk_create_relations(model, user, field, ids, found_ids, invalid_ids=()):
+    existing_ids = set(
+        model.objects
+        .filter(user=user, **{f'{field}_id__in': found_ids})
+        .values_list(f'{field}_id', flat=True)
+    )
+    results = [
+        {
+            'id': target_id,
+            'status': get_bulk_outcome(
+                target_id, found_ids, existing_ids, invalid_ids,
+            ),
+        }
+        for target_id in ids
+    ]
+    new_relations = [
+        model(user=user, **{f'{field}_id': result['id']})
+        for result in results if result['status'] == 'created'
+    ]
+    if new_relations:
+        with transaction.atomic():
+            created_ids = {
+                getattr(relation, f'{field}_id')
+                for relation in insert_relations(model, new_relations)
+            }
+            update_relation_counter(model, created_ids, 1)
+        for result in results:
+            if result['status'] == 'created' and \
+                    result['id'] not in created_ids:
+                result['status'] = 'exists'
+        bump_count_version()
+    return {'results': results}
+
+
+def insert_relations(model, relations):
+    try:
+        with transaction.atomic():
+            return model.objects.bulk_create(relations)
+    except IntegrityError:
+        pass
+    # A concurrent request added some of the rows. Inserting the rest one
+    # by one keeps the counters to the rows that were really created.
+    created = []
+    for relation in relations:
+        try:
+            with transaction.atomic():
+                # bulk_create skips the post_save counter receiver.
+                model.objects.bulk_create([relation])
+        except IntegrityError:
+            continue
+        created.append(relation)
+    return created
+
+
+RECIPE_CACHE_VERSION_KEY = 'recipe-cache-version'
+
+
+def get_recipe_cache_version():
+    return cache.get_or_set(RECIPE_CACHE_VERSION_KEY, 1, timeout=None)
+
+
+def bump_recipe_cache_version():
+    try:
+        cache.incr(RECIPE_CACHE_VERSION_KEY)
+    except ValueError:
+        cache.set(RECIPE_CACHE_VERSION_KEY, 1, timeout=None)
+
+
+def get_recipe_cache_key(recipe_id, version=None):
+    return f'recipe:{version or get_recipe_cache_version()}:{recipe_id}'
+
+
+def get_recipe_author_cache_key(user_id, version=None):
+    return (
+        f'recipe-author:{version or get_recipe_cache_version()}:{user_id}'
+    )
+
+
+def delete_cached_recipes(recipe_ids):
+    version = get_recipe_cache_version()
+    cache.delete_many([
+        get_recipe_cache_key(recipe_id, version) for recipe_id in recipe_ids
+    ])
+
+
+def touch_recipes(recipe_ids):
+    # For changes to rows embedded in recipe responses that do not go
+    # through Recipe.save().
+    Recipe.objects.filter(pk__in=recipe_ids).update(updated_at=timezone.now())
+    transaction.on_commit(partial(delete_cached_recipes, recipe_ids))
+
+
+def delete_cached_recipe_author(user_id):
+    cache.delete(get_recipe_author_cache_key(user_id))
+
+
+def get_cached_recipe(recipe_id):
+    # Cached without request context: user flags are False and file
+    # URLs are relative until overlay_recipe_flags fills them in.
+    version = get_recipe_cache_version()
+    recipe_key = get_recipe_cache_key(recipe_id, version)
+    cached = cache.get(recipe_key)
+    if cached is None:
+        recipe = (
+            Recipe.objects
+            .select_related('author')
+            .prefetch_related(Prefetch(
+                'ingredient_amounts',
+                queryset=IngredientInRecipe.objects.select_related(
+                    'ingredient'
+                ),
+            ))
+            .filter(pk=recipe_id)
+            .first()
+        )
+        if recipe is None:
+            return None
+        data = dict(RecipeSerializer(recipe).data)
+        author = data['author']
+        data['author'] = author['id']
+        cache.set_many(
+            {
+                recipe_key: (data, recipe.updated_at),
+                get_recipe_author_cache_key(author['id'], version): author,
+            },
+            settings.RECIPE_CACHE_TIMEOUT,
+        )
+        return data, author, recipe.updated_at
+
+    data, updated_at = cached
+    author_key = get_recipe_author_cache_key(data['author'], version)
+    author = cache.get(author_key)
+    if author is None:
+        author = UserSerializer(User.objects.get(pk=data['author'])).data
+        cache.set(author_key, author, settings.RECIPE_CACHE_TIMEOUT)
+    return data, author, updated_at
+
+
+def get_recipe_flags(user, recipe_id):
+    flags = {
+        'is_favorited': False,
+        'is_in_shopping_cart': False,
+        'is_subscribed': False,
+    }
+    if not user.is_authenticated:
+        return flags
+    return Recipe.objects.filter(pk=recipe_id).values(
+        is_favorited=Exists(Favorite.objects.filter(
+            user=user, recipe=OuterRef('pk'),
+        )),
+        is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+            user=user, recipe=OuterRef('pk'),
+        )),
+        is_subscribed=Exists(Follow.objects.filter(
+            user=user, following=OuterRef('author'),
+        )),
+    ).first() or flags
+
+
+def overlay_recipe_flags(request, data, author, flags):
+    author = dict(
+        author,
+        is_subscribed=flags['is_subscribed'],
+        avatar_variants=absolutize_variant_urls(
+            request, author['avatar_variants'],
+        ),
+    )
+    if author['avatar']:
+        author['avatar'] = request.build_absolute_uri(author['avatar'])
+    data = dict(
+        data,
+        author=author,
+        image_variants=absolutize_variant_urls(
+            request, data['image_variants'],
+        ),
+        is_favorited=flags['is_favorited'],
+        is_in_shopping_cart=flags['is_in_shopping_cart'],
+    )
+    if data['image']:
+        data['image'] = request.build_absolute_uri(data['image'])
+    return data
+
+
+def get_recipe_etag(recipe_id, updated_at, flags):
+    flag_bits = ''.join(
+        str(int(flags[name])) for name in
+        ['is_favorited', 'is_in_shopping_cart', 'is_subscribed']
+    )
+    return f'"recipe-{recipe_id}-{updated_at.timestamp()}-{flag_bits}"'
+
+
+def aggregate_user_relations(model, aggregate):
+    return Subquery(
+        model.objects
+        .filter(user=OuterRef('pk'))
+        .order_by()
+        .values('user')
+        .annotate(value=aggregate('pk'))
+        .values('value')
+    )
+
+
+def get_recipe_list_validators(request, queryset):
+    # Deletions do not move MAX(updated_at) but bump the count version,
+    # so no exact COUNT is needed here.
+    aggregates = {'latest': Max('updated_at')}
+    if 'ordering' in request.query_params:
+        # refresh_recipe_scores reorders the list without touching recipes.
+        aggregates['scored'] = Max('score__updated_at')
+    state = queryset.order_by().aggregate(**aggregates)
+    relations = None
+    if request.user.is_authenticated:
+        # Every toggle changes either the count or the newest id.
+        relations = User.objects.filter(pk=request.user.pk).values_list(*[
+            aggregate_user_relations(model, aggregate)
+            for model in [Favorite, ShoppingCart, Follow]
+            for aggregate in [Count, Max]
+        ]).first()
+    digest = hashlib.md5(json.dumps(
+        [
+            request.path,
+            sorted(request.query_params.lists()),
+            request.user.pk,
+            get_count_version(),
+            state,
+            relations,
+        ],
+        default=str,
+    ).encode()).hexdigest()
+    return f'"recipes-{digest}"'
+
+
+def set_recipe_validators(response, etag):
+    # Responses carry per-user flags, which a Last-Modified date taken
+    # from the recipes alone cannot describe.
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def get_not_modified_response(request, etag):
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        set_recipe_validators(response, etag)
+    return response
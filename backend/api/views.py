@@ -1,11 +1,30 @@
-from django.db.models import Count
-from django.http import HttpResponse, HttpResponseRedirect, Http404
+from itertools import chain
+
+from django.conf import settings
+from django.db.models import (
+    Exists,
+    F,
+    OuterRef,
+    Prefetch,
+    Value,
+    Window,
+)
+from django.db.models.functions import RowNumber
+from django.http import (
+    HttpResponse,
+    HttpResponseRedirect,
+    Http404,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.renderers import JSONRenderer
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from profiles.serializers import (
     UserSerializer,
@@ -15,12 +34,15 @@ from profiles.serializers import (
 )
 from profiles.models import Follow, User
 from recipes.models import (
+    CatalogVersion,
     Recipe,
     ShoppingCart,
     Favorite,
     Ingredient,
+    IngredientInRecipe,
 )
 from recipes.serializers import (
+    BulkIdsSerializer,
     RecipeSerializer,
     RecipeCreateSerializer,
     RecipeShortSerializer,
@@ -30,14 +52,45 @@ from recipes.serializers import (
 from .paginations import CustomPagination
 from .permissions import OwnerOrReadOnly
 from .filters import RecipeFilter, IngredientFilter
-from .utils import generate_cart_text
+from .renderers import (
+    ShoppingCartTextRenderer,
+    ShoppingCartCSVRenderer,
+    ShoppingCartPDFRenderer,
+)
+from .utils import (
+    bulk_create_relations,
+    create_relation,
+    delete_relation,
+    get_cart_ingredients,
+    get_cached_recipe,
+    get_catalog_snapshot,
+    get_not_modified_response,
+    get_recipe_etag,
+    get_recipe_flags,
+    get_recipe_list_validators,
+    normalize_ingredient_query,
+    overlay_recipe_flags,
+    search_ingredients,
+    set_recipe_validators,
+)
 
 
 class UserViewSet(viewsets.ModelViewSet):
-    queryset = User.objects.all()
     pagination_class = CustomPagination
+    keyset_ordering = ('username', 'id')
     permission_classes = [AllowAny]
 
+    def get_queryset(self):
+        queryset = User.objects.all()
+        user = self.request.user
+        if self.action in ['list', 'retrieve'] and user.is_authenticated:
+            queryset = queryset.annotate(
+                is_subscribed=Exists(Follow.objects.filter(
+                    user=user, following=OuterRef('pk'),
+                )),
+            )
+        return queryset
+
     def get_serializer_class(self):
         if self.action == 'create':
             return UserCreateSerializer
@@ -78,8 +131,8 @@ class UserViewSet(viewsets.ModelViewSet):
     def delete_avatar(self, request):
         user = request.user
         if user.avatar:
-            user.avatar.delete(save=False)
             user.avatar = None
+            user.avatar_variants = {}
             user.save()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
@@ -92,8 +145,20 @@ class UserViewSet(viewsets.ModelViewSet):
         user = request.user
         recipes_limit = request.query_params.get('recipes_limit')
 
+        recipes = Recipe.objects.all()
+        if recipes_limit is not None and recipes_limit.isdigit():
+            recipes = recipes.annotate(
+                row_number=Window(
+                    RowNumber(),
+                    partition_by='author',
+                    order_by=F('pub_date').desc(),
+                ),
+            ).filter(row_number__lte=int(recipes_limit))
+
         queryset = User.objects.filter(following__user=user) \
-            .annotate(recipes_count=Count('recipe'))
+            .annotate(is_subscribed=Value(True)) \
+            .prefetch_related(Prefetch('recipes', queryset=recipes)) \
+            .order_by('username')
         page = self.paginate_queryset(queryset)
 
         context = self.get_serializer_context()
@@ -111,28 +176,47 @@ class UserViewSet(viewsets.ModelViewSet):
         user = request.user
         author = self.get_object()
 
-        if author == user or \
-                Follow.objects.filter(user=user, following=author).exists():
+        if author == user or not create_relation(
+            Follow, user=user, following=author,
+        ):
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
-        Follow.objects.create(user=user, following=author)
-
         serializer = FollowSerializer(
             author,
             context=self._get_follow_context(request),
         )
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(
+        detail=False,
+        methods=['post'],
+        permission_classes=[IsAuthenticated],
+        url_path='subscribe/bulk',
+    )
+    def subscribe_bulk(self, request):
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        found_ids = set(
+            User.objects.filter(id__in=ids).order_by()
+            .values_list('id', flat=True)
+        )
+        return Response(bulk_create_relations(
+            Follow,
+            request.user,
+            'following',
+            ids,
+            found_ids,
+            invalid_ids={request.user.id},
+        ))
+
     @subscribe.mapping.delete
     def unsubscribe(self, request, pk=None):
         user = request.user
         author = self.get_object()
 
-        follow = Follow.objects.filter(user=user, following=author)
-        if not follow.exists():
+        if not delete_relation(Follow, user=user, following=author):
             return Response(status=status.HTTP_400_BAD_REQUEST)
-
-        follow.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -171,31 +255,79 @@ class RecipeViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend]
     filterset_class = RecipeFilter
 
+    @property
+    def keyset_ordering(self):
+        # Score orderings are paginated by page number.
+        if 'ordering' in self.request.query_params:
+            return None
+        return ('-pub_date', '-id')
+
+    def get_queryset(self):
+        queryset = Recipe.objects.all()
+        if self.action not in ['list', 'retrieve', 'update', 'partial_update']:
+            return queryset
+
+        queryset = queryset.select_related('author').prefetch_related(
+            Prefetch(
+                'ingredient_amounts',
+                queryset=IngredientInRecipe.objects.select_related(
+                    'ingredient'
+                ),
+            )
+        )
+        user = self.request.user
+        if user.is_authenticated:
+            queryset = queryset.annotate(
+                is_favorited=Exists(Favorite.objects.filter(
+                    user=user, recipe=OuterRef('pk'),
+                )),
+                is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                    user=user, recipe=OuterRef('pk'),
+                )),
+            )
+        return queryset
+
     def get_serializer_class(self):
         if self.action in ['create', 'update', 'partial_update']:
             return RecipeCreateSerializer
         return RecipeSerializer
 
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        etag = get_recipe_list_validators(request, queryset)
+        not_modified = get_not_modified_response(request, etag)
+        if not_modified is not None:
+            return not_modified
+
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return set_recipe_validators(
+            self.get_paginated_response(serializer.data),
+            etag,
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        # Filter parameters can hide the recipe, leave them to get_object.
+        if request.query_params:
+            return super().retrieve(request, *args, **kwargs)
+        pk = self.kwargs['pk']
+        cached = get_cached_recipe(pk) if pk.isdigit() else None
+        if cached is None:
+            raise Http404
+        data, author, updated_at = cached
+        flags = get_recipe_flags(request.user, data['id'])
+        etag = get_recipe_etag(data['id'], updated_at, flags)
+        not_modified = get_not_modified_response(request, etag)
+        if not_modified is not None:
+            return not_modified
+        return set_recipe_validators(
+            Response(overlay_recipe_flags(request, data, author, flags)),
+            etag,
+        )
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
-    def get_serializer_context(self):
-        context = super().get_serializer_context()
-        user = self.request.user
-        if user.is_authenticated:
-            context['favorited_ids'] = set(
-                Favorite.objects.filter(user=user)
-                .values_list('recipe_id', flat=True)
-            )
-            context['shopping_cart_ids'] = set(
-                ShoppingCart.objects.filter(user=user)
-                .values_list('recipe_id', flat=True)
-            )
-        else:
-            context['favorited_ids'] = set()
-            context['shopping_cart_ids'] = set()
-        return context
-
     @action(
         detail=True,
         methods=['get'],
@@ -210,10 +342,8 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     def _handle_add_relation(self, request, model):
         recipe = self.get_object()
-        user = request.user
-        if model.objects.filter(user=user, recipe=recipe).exists():
+        if not create_relation(model, user=request.user, recipe=recipe):
             return Response(status=status.HTTP_400_BAD_REQUEST)
-        model.objects.create(user=user, recipe=recipe)
         return Response(
             RecipeShortSerializer(recipe).data,
             status=status.HTTP_201_CREATED,
@@ -221,13 +351,22 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     def _handle_remove_relation(self, request, model):
         recipe = self.get_object()
-        user = request.user
-        relation = model.objects.filter(user=user, recipe=recipe)
-        if not relation.exists():
+        if not delete_relation(model, user=request.user, recipe=recipe):
             return Response(status=status.HTTP_400_BAD_REQUEST)
-        relation.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def _handle_bulk_add_relation(self, request, model):
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        found_ids = set(
+            Recipe.objects.filter(id__in=ids).order_by()
+            .values_list('id', flat=True)
+        )
+        return Response(bulk_create_relations(
+            model, request.user, 'recipe', ids, found_ids,
+        ))
+
     @action(
         detail=True,
         methods=['post'],
@@ -240,6 +379,15 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def remove_favorite(self, request, pk=None):
         return self._handle_remove_relation(request, Favorite)
 
+    @action(
+        detail=False,
+        methods=['post'],
+        permission_classes=[IsAuthenticated],
+        url_path='favorite/bulk',
+    )
+    def favorite_bulk(self, request):
+        return self._handle_bulk_add_relation(request, Favorite)
+
     @action(
         detail=True,
         methods=['post'],
@@ -252,23 +400,47 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def remove_from_shopping_cart(self, request, pk=None):
         return self._handle_remove_relation(request, ShoppingCart)
 
+    @action(
+        detail=False,
+        methods=['post'],
+        permission_classes=[IsAuthenticated],
+        url_path='shopping_cart/bulk',
+    )
+    def shopping_cart_bulk(self, request):
+        return self._handle_bulk_add_relation(request, ShoppingCart)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        # The shopping list is streamed past the renderers, so a DRF
+        # Response from that action is an error and stays JSON.
+        if self.action == 'download_shopping_cart' and \
+                isinstance(response, Response):
+            request.accepted_renderer = JSONRenderer()
+            request.accepted_media_type = JSONRenderer.media_type
+        return super().finalize_response(request, response, *args, **kwargs)
+
     @action(
         detail=False,
         methods=['get'],
         permission_classes=[IsAuthenticated],
+        renderer_classes=[
+            ShoppingCartTextRenderer,
+            ShoppingCartCSVRenderer,
+            ShoppingCartPDFRenderer,
+        ],
     )
     def download_shopping_cart(self, request):
-        user = request.user
-
-        items = ShoppingCart.objects.filter(user=user) \
-            .select_related('recipe')
+        ingredients = get_cart_ingredients(request.user).iterator()
+        first = next(ingredients, None)
 
-        if not items.exists():
+        if first is None:
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
-        content = generate_cart_text(items)
-        response = HttpResponse(content, content_type='text/plain')
-        filename = '"shopping_cart.txt"'
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(chain([first], ingredients)),
+            content_type=renderer.get_content_type(),
+        )
+        filename = f'"{renderer.get_filename()}"'
         response['Content-Disposition'] = f'attachment; filename={filename}'
         return response
 
@@ -279,6 +451,41 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = [DjangoFilterBackend]
     filterset_class = IngredientFilter
 
+    def list(self, request, *args, **kwargs):
+        catalog = CatalogVersion.get_current()
+        name = request.query_params.get('name')
+        if not name:
+            return self.get_catalog_response(request, catalog)
+
+        autocomplete = request.query_params.get('autocomplete') in [
+            '1', 'true',
+        ]
+        return Response(search_ingredients(
+            normalize_ingredient_query(name),
+            autocomplete,
+            catalog.version,
+        ))
+
+    def get_catalog_response(self, request, catalog):
+        etag, content = get_catalog_snapshot(
+            catalog.version,
+            catalog.updated_at,
+        )
+        response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(catalog.updated_at.timestamp())
+        patch_cache_control(
+            response,
+            public=True,
+            max_age=settings.INGREDIENT_CATALOG_MAX_AGE,
+        )
+        return get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=int(catalog.updated_at.timestamp()),
+            response=response,
+        )
+
 
 def short_link_redirect(request, short_id):
     try:
@@ -1,27 +1,133 @@
 import base64
-import imghdr
-import uuid
-from django.core.files.base import ContentFile
+import binascii
+import hashlib
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.core.files import File
+from PIL import Image, ImageOps
 from rest_framework import serializers
 
+from .storage import get_content_name
+
 MAX_IMAGE_SIZE = 5 * 1024 * 1024
+BASE64_SEPARATOR = ';base64,'
+MAX_HEADER_LENGTH = 64
+# Encoded characters per chunk; a multiple of 4 decodes independently.
+DECODE_CHUNK_SIZE = 64 * 1024
+
+IMAGE_EXTENSIONS = {
+    'JPEG': 'jpg',
+    'PNG': 'png',
+    'GIF': 'gif',
+    'WEBP': 'webp',
+}
+METADATA_KEYS = {
+    'comment',
+    'exif',
+    'icc_profile',
+    'photoshop',
+    'xmp',
+    'XML:com.adobe.xmp',
+}
+
+
+def get_decoded_size(data, start):
+    encoded_length = len(data) - start
+    if encoded_length % 4:
+        raise serializers.ValidationError()
+    padding = 2 if data.endswith('==') else 1 if data.endswith('=') else 0
+    return encoded_length // 4 * 3 - padding
+
+
+def decode_to_file(data, start):
+    file = SpooledTemporaryFile(
+        max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE,
+    )
+    digest = hashlib.sha256()
+    try:
+        for offset in range(start, len(data), DECODE_CHUNK_SIZE):
+            chunk = base64.b64decode(
+                data[offset:offset + DECODE_CHUNK_SIZE],
+                validate=True,
+            )
+            digest.update(chunk)
+            file.write(chunk)
+    except binascii.Error:
+        file.close()
+        raise serializers.ValidationError()
+    file.seek(0)
+    return file, digest.hexdigest()
+
+
+def hash_file(file):
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(DECODE_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def strip_metadata(file, digest, image_format):
+    with Image.open(file) as image:
+        metadata = (
+            METADATA_KEYS | set(getattr(image, 'text', {}))
+        ) & set(image.info)
+        if not metadata and not image.getexif():
+            # Re-encoding is lossy, so clean images are stored as uploaded.
+            file.seek(0)
+            return file, digest
+        animated = getattr(image, 'is_animated', False)
+        stripped = image if animated else ImageOps.exif_transpose(image)
+        stripped.info = {
+            key: value for key, value in image.info.items()
+            if key not in metadata
+        }
+        options = {'quality': 90} if image_format in ['JPEG', 'WEBP'] else {}
+        if animated:
+            options['save_all'] = True
+        result = SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE,
+        )
+        try:
+            stripped.save(result, format=image_format, **options)
+        except (OSError, ValueError):
+            result.close()
+            raise
+    file.close()
+    return result, hash_file(result)
 
 
 class Base64ImageField(serializers.ImageField):
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            file_data = base64.b64decode(imgstr)
-
-            if len(file_data) > MAX_IMAGE_SIZE:
+            separator = data.find(BASE64_SEPARATOR, 0, MAX_HEADER_LENGTH)
+            if separator == -1:
+                raise serializers.ValidationError()
+            start = separator + len(BASE64_SEPARATOR)
+            if get_decoded_size(data, start) > MAX_IMAGE_SIZE:
                 raise serializers.ValidationError()
 
-            file_name = f'{uuid.uuid4()}.{ext}'
-            valid_image = imghdr.what(None, file_data)
-            if not valid_image:
+            file, digest = decode_to_file(data, start)
+            try:
+                with Image.open(file) as image:
+                    image.verify()
+                    image_format = image.format
+            except (OSError, SyntaxError, Image.DecompressionBombError):
+                image_format = None
+            if image_format not in IMAGE_EXTENSIONS:
+                file.close()
                 raise serializers.ValidationError()
 
-            return ContentFile(file_data, name=file_name)
+            file.seek(0)
+            try:
+                file, digest = strip_metadata(file, digest, image_format)
+            except (OSError, ValueError, Image.DecompressionBombError):
+                file.close()
+                raise serializers.ValidationError()
+            return File(file, name=get_content_name(
+                digest, IMAGE_EXTENSIONS[image_format],
+            ))
 
         return super().to_internal_value(data)
@@ -0,0 +1,162 @@
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+IMAGE_FIELDS = {
+    'recipes.Recipe': ('image', 'image_variants', ['card', 'detail']),
+    'profiles.User': ('avatar', 'avatar_variants', ['avatar']),
+}
+
+PILLOW_FORMATS = {
+    'webp': 'WEBP',
+    'jpeg': 'JPEG',
+}
+
+executor = None
+
+
+def get_executor():
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_PROCESSING_WORKERS,
+            thread_name_prefix='image-variants',
+        )
+    return executor
+
+
+def needs_processing(instance):
+    field, variants_field, _ = IMAGE_FIELDS[instance._meta.label]
+    name = getattr(instance, field).name
+    source = getattr(instance, variants_field).get('source')
+    return bool(name) and source != name
+
+
+def schedule_processing(instance):
+    field = IMAGE_FIELDS[instance._meta.label][0]
+    args = (instance._meta.label, instance.pk, getattr(instance, field).name)
+    if settings.IMAGE_PROCESSING_WORKERS:
+        transaction.on_commit(lambda: get_executor().submit(run_task, *args))
+    else:
+        transaction.on_commit(lambda: process_image(*args))
+
+
+def run_task(label, pk, name):
+    try:
+        process_image(label, pk, name)
+    except Exception:
+        logger.exception('Не удалось обработать изображение %s', name)
+    finally:
+        connections.close_all()
+
+
+def encode(image, image_format, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, **options)
+    return ContentFile(buffer.getvalue())
+
+
+def make_variant(image, width, image_format):
+    variant = image.copy()
+    if variant.width > width:
+        variant.thumbnail((width, variant.height))
+    if image_format == 'JPEG' and variant.mode != 'RGB':
+        background = Image.new('RGB', variant.size, 'white')
+        variant = variant.convert('RGBA')
+        background.paste(variant, mask=variant.getchannel('A'))
+        variant = background
+    elif variant.mode not in ['RGB', 'RGBA']:
+        variant = variant.convert('RGBA')
+    return encode(
+        variant,
+        image_format,
+        quality=settings.IMAGE_VARIANT_QUALITY,
+        optimize=True,
+    )
+
+
+def process_image(label, pk, name):
+    model = apps.get_model(label)
+    field, variants_field, variant_names = IMAGE_FIELDS[label]
+    storage = model._meta.get_field(field).storage
+    try:
+        with storage.open(name) as file:
+            image = Image.open(file)
+            image.load()
+    except (OSError, Image.DecompressionBombError) as error:
+        logger.warning('Изображение %s не обработано: %s', name, error)
+        return
+
+    # Uploads are stripped by Base64ImageField; older originals may still
+    # carry an EXIF orientation.
+    image = ImageOps.exif_transpose(image)
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    variants = {}
+    for variant_name in variant_names:
+        width = settings.IMAGE_VARIANT_WIDTHS[variant_name]
+        variants[variant_name] = {
+            extension: storage.save(
+                os.path.join(
+                    directory,
+                    'variants',
+                    f'{stem}_{variant_name}_{width}.{extension}',
+                ),
+                make_variant(image, width, image_format),
+            )
+            for extension, image_format in PILLOW_FORMATS.items()
+        }
+
+    update_fields = [variants_field]
+    if any(model_field.name == 'updated_at'
+           for model_field in model._meta.fields):
+        update_fields.append('updated_at')
+    with transaction.atomic():
+        instance = model.objects.select_for_update().filter(pk=pk).first()
+        if instance is None or getattr(instance, field).name != name:
+            # Replaced or deleted while processing; gc_media removes the
+            # files nothing points at.
+            return
+        setattr(instance, variants_field, {
+            'source': name,
+            'variants': variants,
+        })
+        instance.save(update_fields=update_fields)
+
+
+def get_variant_urls(instance, request=None):
+    field, variants_field, _ = IMAGE_FIELDS[instance._meta.label]
+    stored = getattr(instance, variants_field)
+    image = getattr(instance, field)
+    if not image or stored.get('source') != image.name:
+        # Not processed yet after a new upload.
+        return {}
+    urls = {
+        variant_name: {
+            extension: image.storage.url(path)
+            for extension, path in formats.items()
+        }
+        for variant_name, formats in stored['variants'].items()
+    }
+    if request is not None:
+        urls = absolutize_variant_urls(request, urls)
+    return urls
+
+
+def absolutize_variant_urls(request, urls):
+    return {
+        variant_name: {
+            extension: request.build_absolute_uri(url)
+            for extension, url in formats.items()
+        }
+        for variant_name, formats in urls.items()
+    }
@@ -79,6 +79,8 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'foodgram_backend.wsgi.application'
 
+TEST_RUNNER = 'foodgram_backend.test_runner.TestRunner'
+
 AUTH_USER_MODEL = 'profiles.User'
 
 # Database
@@ -97,6 +99,17 @@ DATABASES = {
 }
 
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache',
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -137,6 +150,44 @@ STATIC_ROOT = BASE_DIR / 'collected_static'
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+STORAGES = {
+    'default': {
+        'BACKEND': 'foodgram_backend.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+PAGINATION_COUNT_CACHE_TIMEOUT = 30
+PAGINATION_ESTIMATE_THRESHOLD = 100_000
+
+BULK_RELATIONS_MAX_IDS = 100
+
+INGREDIENT_AUTOCOMPLETE_LIMIT = 20
+INGREDIENT_SEARCH_CACHE_SIZE = 1024
+INGREDIENT_CATALOG_MAX_AGE = 60 * 60
+
+RECIPE_CACHE_TIMEOUT = 60 * 60
+
+IMAGE_PROCESSING_WORKERS = int(os.getenv('IMAGE_PROCESSING_WORKERS', 2))
+IMAGE_VARIANT_WIDTHS = {
+    'card': 480,
+    'detail': 1200,
+    'avatar': 160,
+}
+IMAGE_VARIANT_QUALITY = 80
+
+RECIPE_SCORE_FAVORITE_WEIGHT = 1
+RECIPE_SCORE_CART_WEIGHT = 2
+RECIPE_TRENDING_WINDOW_DAYS = 30
+RECIPE_TRENDING_HALF_LIFE_DAYS = 3
+
+SHOPPING_CART_PDF_FONT = os.getenv(
+    'SHOPPING_CART_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
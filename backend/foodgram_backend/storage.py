@@ -0,0 +1,26 @@
+import os
+import re
+
+from django.core.files.storage import FileSystemStorage
+
+CONTENT_ADDRESSED_NAME = re.compile(r'^[0-9a-f]{64}(_\w+)?\.\w+$')
+
+
+def get_content_name(digest, extension):
+    return f'{digest[:2]}/{digest}.{extension}'
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def save(self, name, content, max_length=None):
+        # A hash-named file already on disk has the same content. Reusing
+        # it restarts its gc_media grace period, so the file outlives the
+        # transaction that is about to reference it.
+        name = self.generate_filename(name)
+        if CONTENT_ADDRESSED_NAME.match(name.rsplit('/', 1)[-1]):
+            try:
+                os.utime(self.path(name))
+                return name
+            except FileNotFoundError:
+                pass
+        return super().save(name, content, max_length)
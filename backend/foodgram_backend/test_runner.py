@@ -0,0 +1,24 @@
+import shutil
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    # On-commit callbacks executed by tests build image variants inline
+    # and write them to a scratch directory, not the real media root.
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.media_root = tempfile.mkdtemp()
+        self.test_settings = override_settings(
+            MEDIA_ROOT=self.media_root,
+            IMAGE_PROCESSING_WORKERS=0,
+        )
+        self.test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_settings.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
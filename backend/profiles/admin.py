@@ -1,5 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+
+from api.admin import RelationCounterAdminMixin
 from .models import User, Follow
 
 
@@ -30,7 +32,7 @@ class UserAdmin(BaseUserAdmin):
 
 
 @admin.register(Follow)
-class FollowAdmin(admin.ModelAdmin):
+class FollowAdmin(RelationCounterAdminMixin, admin.ModelAdmin):
     list_display = (
         'user',
         'following',
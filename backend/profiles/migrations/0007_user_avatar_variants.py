@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 02:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0006_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='avatar_variants',
+            field=models.JSONField(default=dict, editable=False, verbose_name='Уменьшенные копии аватара'),
+        ),
+    ]
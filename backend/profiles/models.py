@@ -2,8 +2,10 @@ from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
 from django.db import models
 
+from foodgram_backend.counters import CounterFieldsMixin
 
-class User(AbstractUser):
+
+class User(CounterFieldsMixin, AbstractUser):
     email = models.EmailField(
         unique=True,
         verbose_name='Email',
@@ -27,6 +29,23 @@ class User(AbstractUser):
         null=True,
         verbose_name='Аватар',
     )
+    avatar_variants = models.JSONField(
+        default=dict,
+        editable=False,
+        verbose_name='Уменьшенные копии аватара',
+    )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество рецептов',
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество подписчиков',
+    )
+
+    counter_fields = ('recipes_count', 'followers_count')
 
     class Meta:
         verbose_name = "Пользователь"
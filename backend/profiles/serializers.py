@@ -1,11 +1,34 @@
 from rest_framework import serializers
 from .models import User, Follow
 from foodgram_backend.image_field import Base64ImageField
+from foodgram_backend.images import get_variant_urls
 
 
-class UserSerializer(serializers.ModelSerializer):
+def get_subscribed_ids(context):
+    if 'subscribed_ids' not in context:
+        request = context.get('request')
+        if request and request.user.is_authenticated:
+            context['subscribed_ids'] = set(
+                Follow.objects.filter(user=request.user)
+                .values_list('following_id', flat=True)
+            )
+        else:
+            context['subscribed_ids'] = set()
+    return context['subscribed_ids']
+
+
+class SubscribedMixin:
+
+    def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return obj.id in get_subscribed_ids(self.context)
+
+
+class UserSerializer(SubscribedMixin, serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
     avatar = serializers.ImageField(read_only=True)
+    avatar_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = User
@@ -17,13 +40,11 @@ class UserSerializer(serializers.ModelSerializer):
             'last_name',
             'is_subscribed',
             'avatar',
+            'avatar_variants',
         )
 
-    def get_is_subscribed(self, obj):
-        request = self.context.get('request')
-        if not request or not request.user.is_authenticated:
-            return False
-        return Follow.objects.filter(user=request.user, following=obj).exists()
+    def get_avatar_variants(self, obj):
+        return get_variant_urls(obj, self.context.get('request'))
 
 
 class UserCreateSerializer(serializers.ModelSerializer):
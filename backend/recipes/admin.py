@@ -1,6 +1,7 @@
 from django.contrib import admin
-from django.db.models import Count
 
+from api.admin import RelationCounterAdminMixin
+from api.utils import touch_recipes
 from .models import (
     Ingredient,
     Recipe,
@@ -31,7 +32,8 @@ class RecipeAdmin(admin.ModelAdmin):
     list_display = (
         'name',
         'author',
-        'favorites_count'
+        'favorites_count',
+        'shopping_cart_count',
     )
     search_fields = (
         'name',
@@ -40,17 +42,9 @@ class RecipeAdmin(admin.ModelAdmin):
     )
     inlines = [IngredientInRecipeInline]
 
-    def get_queryset(self, request):
-        queryset = super().get_queryset(request)
-        return queryset.annotate(fav_count=Count('favorited_by'))
-
-    @admin.display(description='Добавлений в избранное')
-    def favorites_count(self, obj):
-        return obj.fav_count
-
 
 @admin.register(Favorite)
-class FavoriteAdmin(admin.ModelAdmin):
+class FavoriteAdmin(RelationCounterAdminMixin, admin.ModelAdmin):
     list_display = (
         'user',
         'recipe',
@@ -58,7 +52,7 @@ class FavoriteAdmin(admin.ModelAdmin):
 
 
 @admin.register(ShoppingCart)
-class ShoppingCartAdmin(admin.ModelAdmin):
+class ShoppingCartAdmin(RelationCounterAdminMixin, admin.ModelAdmin):
     list_display = (
         'user',
         'recipe',
@@ -72,3 +66,19 @@ class IngredientInRecipeAdmin(admin.ModelAdmin):
         'ingredient',
         'amount',
     )
+
+    # Saves are handled by a post_save receiver; a post_delete one would
+    # make every recipe deletion fetch its ingredient rows.
+    def save_model(self, request, obj, form, change):
+        if change and 'recipe' in form.changed_data:
+            touch_recipes([form.initial['recipe']])
+        super().save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        touch_recipes([obj.recipe_id])
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = list(queryset.values_list('recipe_id', flat=True))
+        super().delete_queryset(request, queryset)
+        touch_recipes(set(recipe_ids))
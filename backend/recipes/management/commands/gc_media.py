@@ -0,0 +1,79 @@
+import posixpath
+from datetime import timedelta
+
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from foodgram_backend.images import IMAGE_FIELDS
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет файлы изображений, на которые не ссылается ни один '
+        'рецепт или пользователь'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-minutes',
+            type=int,
+            default=60,
+            help='Не удалять файлы моложе указанного возраста: они могут '
+                 'принадлежать еще не сохраненным загрузкам.',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, что будет удалено.',
+        )
+
+    def get_referenced(self):
+        referenced = set()
+        for label, (field, variants_field, _) in IMAGE_FIELDS.items():
+            rows = (
+                apps.get_model(label).objects
+                .values_list(field, variants_field)
+                .iterator()
+            )
+            for name, stored in rows:
+                if name:
+                    referenced.add(name)
+                for formats in stored.get('variants', {}).values():
+                    referenced.update(formats.values())
+        return referenced
+
+    def walk(self, directory):
+        directories, files = default_storage.listdir(directory)
+        for file in files:
+            yield posixpath.join(directory, file)
+        for subdirectory in directories:
+            yield from self.walk(posixpath.join(directory, subdirectory))
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(minutes=options['grace_minutes'])
+        referenced = self.get_referenced()
+        directories = {
+            apps.get_model(label)._meta.get_field(field).upload_to.strip('/')
+            for label, (field, _, _) in IMAGE_FIELDS.items()
+        }
+        deleted = 0
+        freed = 0
+        for directory in sorted(directories):
+            if not default_storage.exists(directory):
+                continue
+            for path in self.walk(directory):
+                if path in referenced or \
+                        default_storage.get_modified_time(path) > cutoff:
+                    continue
+                freed += default_storage.size(path)
+                deleted += 1
+                if options['dry_run']:
+                    self.stdout.write(path)
+                else:
+                    default_storage.delete(path)
+
+        message = f'Удалено файлов: {deleted}, освобождено {freed} байт'
+        if options['dry_run']:
+            message += ' — пробный запуск, файлы не удалены'
+        self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,42 @@
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from foodgram_backend.images import IMAGE_FIELDS, process_image
+
+
+class Command(BaseCommand):
+    help = (
+        'Создает уменьшенные копии изображений рецептов и аватаров, '
+        'загруженных до появления фоновой обработки'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Пересоздать копии для всех изображений.',
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        for label, (field, variants_field, _) in IMAGE_FIELDS.items():
+            model = apps.get_model(label)
+            processed = 0
+            rows = (
+                model.objects
+                .exclude(**{field: ''})
+                .exclude(**{f'{field}__isnull': True})
+                .values_list('pk', field, variants_field)
+                .iterator()
+            )
+            for pk, name, variants in rows:
+                if options['force'] or variants.get('source') != name:
+                    process_image(label, pk, name)
+                    processed += 1
+            self.stdout.write(
+                f'{model._meta.verbose_name_plural}: обработано {processed}'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {time.perf_counter() - started:.1f} с'
+        ))
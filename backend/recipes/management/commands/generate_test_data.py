@@ -0,0 +1,210 @@
+import random
+import time
+from datetime import timedelta
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from profiles.models import Follow, User
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    IngredientInRecipe,
+    Recipe,
+    ShoppingCart,
+)
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def heavy_tail_weights(count, skew):
+    return [1 / (rank + 1) ** skew for rank in range(count)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Генерирует пользователей, рецепты, подписки, избранное и '
+        'корзины для нагрузочного тестирования'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument(
+            '--ingredients-per-recipe',
+            type=int,
+            nargs=2,
+            default=(3, 12),
+            metavar=('MIN', 'MAX'),
+        )
+        parser.add_argument(
+            '--follows',
+            type=int,
+            default=10,
+            help='Среднее число подписок на пользователя.',
+        )
+        parser.add_argument(
+            '--favorites',
+            type=int,
+            default=20,
+            help='Среднее число рецептов в избранном на пользователя.',
+        )
+        parser.add_argument(
+            '--cart',
+            type=int,
+            default=5,
+            help='Среднее число рецептов в корзине на пользователя.',
+        )
+        parser.add_argument(
+            '--author-skew',
+            type=float,
+            default=1.0,
+            help='Показатель степенного распределения авторов и рецептов; '
+                 '0 — равномерное.',
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=365,
+            help='Период, по которому распределяются даты публикации.',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--password',
+            default='password',
+            help='Пароль всех созданных пользователей.',
+        )
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.skew = options['author_skew']
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        if not ingredient_ids:
+            raise CommandError(
+                'Ингредиенты не найдены, выполните import_ingredients.'
+            )
+        low, high = options['ingredients_per_recipe']
+        if not 1 <= low <= high:
+            raise CommandError('Некорректный диапазон ингредиентов.')
+        high = min(high, len(ingredient_ids))
+        low = min(low, high)
+
+        started = time.perf_counter()
+        with transaction.atomic():
+            users = self.create_users(options['users'], options['password'])
+            recipes = self.create_recipes(
+                users, options['recipes'], options['days'],
+            )
+            self.create_ingredient_rows(recipes, ingredient_ids, low, high)
+            self.create_relations(
+                Follow, 'following', users, users, options['follows'],
+            )
+            self.create_relations(
+                Favorite, 'recipe', users, recipes, options['favorites'],
+            )
+            self.create_relations(
+                ShoppingCart, 'recipe', users, recipes, options['cart'],
+            )
+            call_command('recount', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f'Данные сгенерированы за {time.perf_counter() - started:.1f} с'
+        ))
+
+    def report(self, model, count):
+        self.stdout.write(f'{model._meta.verbose_name_plural}: {count}')
+
+    def create_users(self, count, password):
+        password = make_password(password)
+        offset = User.objects.count()
+        users = []
+        for batch in batched(range(offset, offset + count), self.batch_size):
+            users += User.objects.bulk_create([
+                User(
+                    username=f'load_user_{number}',
+                    email=f'load_user_{number}@example.com',
+                    first_name=f'Имя {number}',
+                    last_name=f'Фамилия {number}',
+                    password=password,
+                )
+                for number in batch
+            ])
+        self.rng.shuffle(users)
+        self.report(User, len(users))
+        return users
+
+    def create_recipes(self, authors, count, days):
+        if not authors:
+            return []
+        now = timezone.now()
+        weights = heavy_tail_weights(len(authors), self.skew)
+        recipes = []
+        for batch in batched(range(count), self.batch_size):
+            batch_recipes = Recipe.objects.bulk_create([
+                Recipe(
+                    author=author,
+                    name=f'Рецепт {number}',
+                    image='recipes/placeholder.png',
+                    text=f'Описание рецепта {number}',
+                    cooking_time=self.rng.randint(5, 240),
+                )
+                for number, author in zip(
+                    batch,
+                    self.rng.choices(authors, weights, k=len(batch)),
+                )
+            ])
+            for recipe in batch_recipes:
+                recipe.pub_date = now - timedelta(
+                    seconds=self.rng.randint(0, days * 24 * 60 * 60),
+                )
+            Recipe.objects.bulk_update(batch_recipes, ['pub_date'])
+            recipes += batch_recipes
+        self.rng.shuffle(recipes)
+        self.report(Recipe, len(recipes))
+        return recipes
+
+    def create_ingredient_rows(self, recipes, ingredient_ids, low, high):
+        rows = (
+            IngredientInRecipe(
+                recipe=recipe,
+                ingredient_id=ingredient_id,
+                amount=self.rng.randint(1, 1000),
+            )
+            for recipe in recipes
+            for ingredient_id in self.rng.sample(
+                ingredient_ids, self.rng.randint(low, high),
+            )
+        )
+        created = 0
+        for batch in batched(rows, self.batch_size):
+            IngredientInRecipe.objects.bulk_create(batch)
+            created += len(batch)
+        self.report(IngredientInRecipe, created)
+
+    def create_relations(self, model, field, users, targets, average):
+        if not users or not targets or average <= 0:
+            return
+        weights = heavy_tail_weights(len(targets), self.skew)
+        relations = (
+            model(user=user, **{field: target})
+            for user in users
+            for target in set(self.rng.choices(
+                targets,
+                weights,
+                k=self.rng.randint(0, 2 * average),
+            ))
+            if target != user
+        )
+        created = 0
+        for batch in batched(relations, self.batch_size):
+            model.objects.bulk_create(batch, ignore_conflicts=True)
+            created += len(batch)
+        self.report(model, created)
@@ -1,28 +1,159 @@
-import os
+import csv
 import json
-from django.core.management.base import BaseCommand
-from recipes.models import Ingredient
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from recipes.models import CatalogVersion, Ingredient
+
+READ_CHUNK_SIZE = 64 * 1024
+INGREDIENT_KEYS = {'name', 'measurement_unit'}
+
+
+def iter_json(file):
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if not started and position < len(buffer):
+            if buffer[position] != '[':
+                raise CommandError('Ожидается JSON-массив объектов.')
+            started = True
+            position += 1
+            continue
+        if started and position < len(buffer) and buffer[position] == ']':
+            return
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise CommandError('Некорректный JSON-файл.')
+            chunk = file.read(READ_CHUNK_SIZE)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        if not isinstance(item, dict) or not INGREDIENT_KEYS <= item.keys():
+            raise CommandError(
+                'Элементы JSON-массива должны быть объектами с полями '
+                'name и measurement_unit.'
+            )
+        yield item['name'], item['measurement_unit']
+
+
+def iter_csv(file):
+    reader = csv.reader(file)
+    for row in reader:
+        if not row:
+            continue
+        if len(row) < 2:
+            raise CommandError(
+                f'Строка {reader.line_num}: ожидается название и единица '
+                'измерения.'
+            )
+        yield row[0], row[1]
+
+
+READERS = {
+    '.json': iter_json,
+    '.csv': iter_csv,
+}
 
 
 class Command(BaseCommand):
-    help = 'Импортирует данные из JSON файла в модель Ingredient'
+    help = 'Импортирует ингредиенты из JSON и CSV файлов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            default=settings.BASE_DIR / 'data',
+            type=Path,
+            help='Файл или каталог с файлами ингредиентов.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            default=1000,
+            type=int,
+            help='Количество строк в одном INSERT.',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Выполнить импорт и откатить транзакцию.',
+        )
+
+    def get_files(self, path):
+        if path.is_dir():
+            return sorted(
+                file for file in path.iterdir() if file.suffix in READERS
+            )
+        if path.suffix in READERS:
+            return [path]
+        raise CommandError(f'Неподдерживаемый файл: {path}')
+
+    def read_ingredients(self, file_path):
+        with open(file_path, 'r', encoding='utf-8', newline='') as file:
+            for name, measurement_unit in READERS[file_path.suffix](file):
+                if not isinstance(name, str) or \
+                        not isinstance(measurement_unit, str):
+                    raise CommandError(
+                        f'{file_path.name}: название и единица измерения '
+                        'должны быть строками.'
+                    )
+                name, measurement_unit = name.strip(), measurement_unit.strip()
+                if name and measurement_unit:
+                    yield Ingredient(
+                        name=name,
+                        measurement_unit=measurement_unit,
+                    )
 
-    def handle(self, *args, **kwargs):
-        data_folder = '/app/data'
+    def import_file(self, file_path, batch_size):
+        rows = 0
+        ingredients = self.read_ingredients(file_path)
+        while batch := list(islice(ingredients, batch_size)):
+            Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+            rows += len(batch)
+        return rows
 
-        for filename in os.listdir(data_folder):
-            if filename.endswith('.json'):
-                file_path = os.path.join(data_folder, filename)
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    data = json.load(file)
+    def handle(self, *args, **options):
+        path = options['path']
+        batch_size = options['batch_size']
+        if not path.exists():
+            raise CommandError(f'Путь не найден: {path}')
+        if batch_size < 1:
+            raise CommandError('--batch-size должен быть положительным.')
 
-                    for item in data:
-                        name = item['name']
-                        measurement_unit = item['measurement_unit']
+        started = time.perf_counter()
+        rows = 0
+        with transaction.atomic():
+            count_before = Ingredient.objects.count()
+            for file_path in self.get_files(path):
+                file_rows = self.import_file(file_path, batch_size)
+                rows += file_rows
+                self.stdout.write(
+                    f'{file_path.name}: прочитано строк {file_rows}'
+                )
+            created = Ingredient.objects.count() - count_before
 
-                        Ingredient.objects.create(
-                            name=name,
-                            measurement_unit=measurement_unit)
+            if options['dry_run']:
+                transaction.set_rollback(True)
+            elif created:
+                CatalogVersion.bump()
 
-                self.stdout.write(self.style.SUCCESS(
-                    f'Импорт данных из файла {filename} завершен'))
+        elapsed = time.perf_counter() - started
+        rate = rows / elapsed if elapsed else rows
+        message = (
+            f'Импорт завершен: строк {rows}, добавлено {created}, '
+            f'{elapsed:.2f} с ({rate:.0f} строк/с)'
+        )
+        if options['dry_run']:
+            message += ' — пробный запуск, изменения отменены'
+        self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from profiles.models import Follow, User
+from recipes.models import Favorite, Recipe, ShoppingCart
+
+
+def count_related(model, field):
+    return Coalesce(
+        Subquery(
+            model.objects
+            .filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(total=Count('pk'))
+            .values('total')
+        ),
+        0,
+    )
+
+
+COUNTERS = [
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'shopping_cart_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follow, 'following'),
+]
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает денормализованные счетчики рецептов и пользователей'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            for model, counter, related_model, field in COUNTERS:
+                expected = count_related(related_model, field)
+                fixed = (
+                    model.objects
+                    .annotate(expected=expected)
+                    .exclude(**{counter: F('expected')})
+                    .update(**{counter: expected})
+                )
+                self.stdout.write(
+                    f'{model._meta.verbose_name_plural}.{counter}: '
+                    f'исправлено {fixed}'
+                )
+        self.stdout.write(self.style.SUCCESS('Счетчики пересчитаны'))
@@ -0,0 +1,100 @@
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from recipes.models import Favorite, Recipe, RecipeScore, ShoppingCart
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает рейтинги рецептов для сортировок popular и trending'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            default=1000,
+            type=int,
+            help='Количество рецептов, пересчитываемых за одну транзакцию.',
+        )
+
+    def get_trending(self, first_id, last_id, since, today):
+        half_life = settings.RECIPE_TRENDING_HALF_LIFE_DAYS
+        trending = defaultdict(float)
+        for model, weight in (
+            (Favorite, settings.RECIPE_SCORE_FAVORITE_WEIGHT),
+            (ShoppingCart, settings.RECIPE_SCORE_CART_WEIGHT),
+        ):
+            rows = (
+                model.objects
+                .filter(
+                    recipe__gte=first_id,
+                    recipe__lte=last_id,
+                    created_at__gte=since,
+                )
+                .annotate(day=TruncDate('created_at'))
+                .values('recipe_id', 'day')
+                .annotate(total=Count('pk'))
+                .order_by()
+            )
+            for row in rows:
+                age = (today - row['day']).days
+                trending[row['recipe_id']] += (
+                    weight * row['total'] * 0.5 ** (age / half_life)
+                )
+        return trending
+
+    def refresh_batch(self, recipes, since, today, now):
+        trending = self.get_trending(
+            recipes[0][0], recipes[-1][0], since, today,
+        )
+        RecipeScore.objects.bulk_create(
+            [
+                RecipeScore(
+                    recipe_id=recipe_id,
+                    popular=(
+                        settings.RECIPE_SCORE_FAVORITE_WEIGHT * favorites_count
+                        + settings.RECIPE_SCORE_CART_WEIGHT
+                        * shopping_cart_count
+                    ),
+                    trending=trending[recipe_id],
+                    updated_at=now,
+                )
+                for recipe_id, favorites_count, shopping_cart_count in recipes
+            ],
+            update_conflicts=True,
+            unique_fields=['recipe'],
+            update_fields=['popular', 'trending', 'updated_at'],
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size должен быть положительным.')
+
+        started = time.perf_counter()
+        now = timezone.now()
+        today = timezone.localdate(now)
+        since = now - timedelta(days=settings.RECIPE_TRENDING_WINDOW_DAYS)
+        last_id = 0
+        refreshed = 0
+        while recipes := list(
+            Recipe.objects
+            .filter(pk__gt=last_id)
+            .order_by('pk')
+            .values_list('pk', 'favorites_count', 'shopping_cart_count')
+            [:batch_size]
+        ):
+            with transaction.atomic():
+                self.refresh_batch(recipes, since, today, now)
+            last_id = recipes[-1][0]
+            refreshed += len(recipes)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Рейтинги пересчитаны: рецептов {refreshed}, '
+            f'{time.perf_counter() - started:.2f} с'
+        ))
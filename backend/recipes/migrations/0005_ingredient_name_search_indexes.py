@@ -0,0 +1,40 @@
+from django.db import DatabaseError, migrations, transaction
+
+PREFIX_INDEX = 'recipes_ingredient_name_upper_idx'
+TRIGRAM_INDEX = 'recipes_ingredient_name_trgm_idx'
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        f'CREATE INDEX IF NOT EXISTS {PREFIX_INDEX} '
+        'ON recipes_ingredient (UPPER(name) text_pattern_ops)'
+    )
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            schema_editor.execute(
+                f'CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEX} '
+                'ON recipes_ingredient USING gin (UPPER(name) gin_trgm_ops)'
+            )
+    except DatabaseError:
+        pass
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP INDEX IF EXISTS {TRIGRAM_INDEX}')
+    schema_editor.execute(f'DROP INDEX IF EXISTS {PREFIX_INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_alter_favorite_options_alter_shoppingcart_options'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,60 @@
+from django.db import migrations
+from django.db.models import Count, F, Min, OuterRef, Subquery
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientInRecipe = apps.get_model('recipes', 'IngredientInRecipe')
+
+    duplicates = (
+        Ingredient.objects
+        .values('name', 'measurement_unit')
+        .annotate(keep_id=Min('id'), total=Count('id'))
+        .filter(total__gt=1)
+    )
+    for group in duplicates:
+        duplicate_ids = list(
+            Ingredient.objects
+            .filter(
+                name=group['name'],
+                measurement_unit=group['measurement_unit'],
+            )
+            .exclude(id=group['keep_id'])
+            .values_list('id', flat=True)
+        )
+        for duplicate_id in duplicate_ids:
+            recipes_with_kept = IngredientInRecipe.objects.filter(
+                ingredient_id=group['keep_id'],
+            ).values('recipe_id')
+            # Recipes listing both keep one row with the amounts summed;
+            # the duplicate's row goes away with the duplicate ingredient.
+            duplicate_amount = IngredientInRecipe.objects.filter(
+                recipe_id=OuterRef('recipe_id'),
+                ingredient_id=duplicate_id,
+            ).values('amount')[:1]
+            IngredientInRecipe.objects.filter(
+                ingredient_id=group['keep_id'],
+                recipe_id__in=IngredientInRecipe.objects.filter(
+                    ingredient_id=duplicate_id,
+                ).values('recipe_id'),
+            ).update(amount=F('amount') + Subquery(duplicate_amount))
+            IngredientInRecipe.objects.filter(
+                ingredient_id=duplicate_id,
+            ).exclude(
+                recipe_id__in=recipes_with_kept,
+            ).update(ingredient_id=group['keep_id'])
+        Ingredient.objects.filter(id__in=duplicate_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_catalogversion'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients,
+            migrations.RunPython.noop,
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def remove_duplicates(apps, schema_editor):
+    for model_name in ['Favorite', 'ShoppingCart']:
+        model = apps.get_model('recipes', model_name)
+        duplicates = (
+            model.objects
+            .values('user_id', 'recipe_id')
+            .annotate(keep_id=Min('id'), total=Count('id'))
+            .filter(total__gt=1)
+        )
+        for group in duplicates:
+            model.objects.filter(
+                user_id=group['user_id'],
+                recipe_id=group['recipe_id'],
+            ).exclude(id=group['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_pub_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,9 @@
+from foodgram_backend.counters import CounterFieldsMixin
 from profiles.models import User
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.models import F
+from django.utils import timezone
 
 
 class Ingredient(models.Model):
@@ -17,12 +20,48 @@ class Ingredient(models.Model):
         verbose_name = "Ингредиент"
         verbose_name_plural = "Ингредиенты"
         ordering = ['name']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient_name_unit',
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
 
-class Recipe(models.Model):
+class CatalogVersion(models.Model):
+    version = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Версия",
+    )
+    updated_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name="Дата изменения",
+    )
+
+    class Meta:
+        verbose_name = "Версия каталога ингредиентов"
+        verbose_name_plural = "Версии каталога ингредиентов"
+
+    def __str__(self):
+        return str(self.version)
+
+    @classmethod
+    def get_current(cls):
+        return cls.objects.get_or_create(pk=1)[0]
+
+    @classmethod
+    def bump(cls):
+        if not cls.objects.filter(pk=1).update(
+            version=F('version') + 1,
+            updated_at=timezone.now(),
+        ):
+            cls.objects.get_or_create(pk=1, defaults={'version': 1})
+
+
+class Recipe(CounterFieldsMixin, models.Model):
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -38,6 +77,11 @@ class Recipe(models.Model):
         upload_to='recipes/',
         verbose_name='Изображение',
     )
+    image_variants = models.JSONField(
+        default=dict,
+        editable=False,
+        verbose_name='Уменьшенные копии изображения',
+    )
     text = models.TextField(
         verbose_name="Описание",
     )
@@ -49,11 +93,41 @@ class Recipe(models.Model):
         auto_now_add=True,
         verbose_name="Дата публикации"
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name="Дата изменения",
+    )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="Добавлений в избранное",
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="Добавлений в корзину",
+    )
+
+    counter_fields = ('favorites_count', 'shopping_cart_count')
 
     class Meta:
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(
+                fields=['pub_date', 'id'],
+                name='recipe_pub_date_id_idx',
+            ),
+            models.Index(
+                fields=['author', 'pub_date'],
+                name='recipe_author_pub_date_idx',
+            ),
+            models.Index(
+                fields=['updated_at'],
+                name='recipe_updated_at_idx',
+            ),
+        ]
         # default_related_name = 'recipes'
 
     def __str__(self):
@@ -100,10 +174,27 @@ class Favorite(models.Model):
         related_name='favorited_by',
         verbose_name="Рецепт",
     )
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        editable=False,
+        verbose_name="Дата добавления",
+    )
 
     class Meta:
         verbose_name = "Избранное"
         verbose_name_plural = "Избранное"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_favorite_user_recipe',
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['recipe', 'created_at'],
+                name='favorite_recipe_created_idx',
+            ),
+        ]
 
 
 class ShoppingCart(models.Model):
@@ -119,7 +210,63 @@ class ShoppingCart(models.Model):
         related_name='in_carts',
         verbose_name="Рецепт",
     )
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        editable=False,
+        verbose_name="Дата добавления",
+    )
 
     class Meta:
         verbose_name = "Корзина"
         verbose_name_plural = "Корзины"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_shopping_cart_user_recipe',
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['recipe', 'created_at'],
+                name='cart_recipe_created_idx',
+            ),
+        ]
+
+
+class RecipeScore(models.Model):
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='score',
+        verbose_name="Рецепт",
+    )
+    popular = models.FloatField(
+        default=0,
+        verbose_name="Популярность",
+    )
+    trending = models.FloatField(
+        default=0,
+        verbose_name="Популярность за последнее время",
+    )
+    updated_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name="Дата пересчета",
+    )
+
+    class Meta:
+        verbose_name = "Рейтинг рецепта"
+        verbose_name_plural = "Рейтинги рецептов"
+        indexes = [
+            models.Index(
+                fields=['-popular', '-recipe'],
+                name='recipe_score_popular_idx',
+            ),
+            models.Index(
+                fields=['-trending', '-recipe'],
+                name='recipe_score_trending_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe_id}: {self.popular:.1f} / {self.trending:.1f}'
@@ -1,6 +1,12 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from rest_framework import serializers
+from rest_framework.exceptions import NotFound
 from foodgram_backend.image_field import Base64ImageField
+from foodgram_backend.images import get_variant_urls
 from profiles.models import User
+from profiles.serializers import SubscribedMixin
 from .models import (
     Recipe,
     Ingredient,
@@ -37,9 +43,10 @@ class IngredientInRecipeSerializer(serializers.ModelSerializer):
 
 
 class IngredientInRecipeCreateSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all(),
-        source='ingredient',
+    # Resolved for the whole list at once in validate_ingredients.
+    id = serializers.IntegerField(
+        min_value=1,
+        source='ingredient_id',
     )
     amount = serializers.IntegerField(
         min_value=1,
@@ -59,11 +66,12 @@ class RecipeSerializer(serializers.ModelSerializer):
     ingredients = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
         fields = (
-            'id', 'author', 'name', 'image',
+            'id', 'author', 'name', 'image', 'image_variants',
             'text', 'cooking_time', 'ingredients',
             'is_favorited', 'is_in_shopping_cart',
         )
@@ -73,15 +81,19 @@ class RecipeSerializer(serializers.ModelSerializer):
         return UserSerializer(obj.author, context=self.context).data
 
     def get_ingredients(self, obj):
-        ingredients = IngredientInRecipe.objects.filter(recipe=obj) \
-            .select_related('ingredient')
-        return IngredientInRecipeSerializer(ingredients, many=True).data
+        return IngredientInRecipeSerializer(
+            obj.ingredient_amounts.all(),
+            many=True,
+        ).data
 
     def get_is_favorited(self, obj):
-        return obj.id in self.context.get('favorited_ids', set())
+        return getattr(obj, 'is_favorited', False)
 
     def get_is_in_shopping_cart(self, obj):
-        return obj.id in self.context.get('shopping_cart_ids', set())
+        return getattr(obj, 'is_in_shopping_cart', False)
+
+    def get_image_variants(self, obj):
+        return get_variant_urls(obj, self.context.get('request'))
 
 
 class RecipeCreateSerializer(serializers.ModelSerializer):
@@ -100,9 +112,17 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
     def validate_ingredients(self, ingredients):
         if not ingredients:
             raise serializers.ValidationError()
-        ids = [item['ingredient'].id for item in ingredients]
+        ids = [item['ingredient_id'] for item in ingredients]
         if len(ids) != len(set(ids)):
             raise serializers.ValidationError()
+        found = Ingredient.objects.in_bulk(ids)
+        missing = [str(pk) for pk in ids if pk not in found]
+        if missing:
+            raise serializers.ValidationError(
+                f'Ингредиенты не найдены: {", ".join(missing)}.'
+            )
+        for item in ingredients:
+            item['ingredient'] = found[item.pop('ingredient_id')]
         return ingredients
 
     def create_ingredients(self, recipe, ingredients):
@@ -116,37 +136,72 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         ingredients_data = validated_data.pop('ingredients')
-        recipe = Recipe.objects.create(**validated_data)
-        self.create_ingredients(recipe, ingredients_data)
+        with transaction.atomic():
+            recipe = Recipe.objects.create(**validated_data)
+            self.create_ingredients(recipe, ingredients_data)
         return recipe
 
+    def update_ingredients(self, recipe, ingredients):
+        amounts = {item['ingredient'].id: item for item in ingredients}
+        changed = []
+        removed = []
+        for row in IngredientInRecipe.objects.filter(recipe=recipe):
+            item = amounts.pop(row.ingredient_id, None)
+            if item is None:
+                removed.append(row.id)
+            elif row.amount != item['amount']:
+                row.amount = item['amount']
+                changed.append(row)
+        if removed:
+            IngredientInRecipe.objects.filter(id__in=removed).delete()
+        if changed:
+            IngredientInRecipe.objects.bulk_update(changed, ['amount'])
+        if amounts:
+            self.create_ingredients(recipe, amounts.values())
+
     def update(self, instance, validated_data):
-        ingredients_data = validated_data.get('ingredients')
+        ingredients_data = validated_data.pop('ingredients', None)
 
         if ingredients_data is not None:
-            for attr, value in validated_data.items():
-                setattr(instance, attr, value)
-            instance.save()
-
-            instance.ingredient_amounts.all().delete()
-            self.create_ingredients(instance, ingredients_data)
-            return instance
+            with transaction.atomic():
+                # Serializes concurrent edits of the same recipe's rows; the
+                # changes are applied to the locked row, not the stale one.
+                recipe = (
+                    Recipe.objects.select_for_update()
+                    .filter(pk=instance.pk).first()
+                )
+                if recipe is None:
+                    raise NotFound('Рецепт не найден.')
+                for attr, value in validated_data.items():
+                    setattr(recipe, attr, value)
+                recipe.save()
+
+                self.update_ingredients(recipe, ingredients_data)
+            return recipe
         else:
             raise serializers.ValidationError()
 
     def to_representation(self, instance):
+        prefetch_related_objects([instance], Prefetch(
+            'ingredient_amounts',
+            queryset=IngredientInRecipe.objects.select_related('ingredient'),
+        ))
         return RecipeSerializer(instance, context=self.context).data
 
 
 class RecipeShortSerializer(serializers.ModelSerializer):
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
         fields = (
             'id', 'name',
-            'image', 'cooking_time',
+            'image', 'image_variants', 'cooking_time',
         )
 
+    def get_image_variants(self, obj):
+        return get_variant_urls(obj, self.context.get('request'))
+
 
 class FavoriteSerializer(serializers.ModelSerializer):
 
@@ -162,11 +217,23 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class FollowSerializer(serializers.ModelSerializer):
+class BulkIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_RELATIONS_MAX_IDS,
+    )
+
+    def validate_ids(self, ids):
+        return list(dict.fromkeys(ids))
+
+
+class FollowSerializer(SubscribedMixin, serializers.ModelSerializer):
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField()
     is_subscribed = serializers.SerializerMethodField()
     avatar = Base64ImageField(read_only=True)
+    avatar_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = User
@@ -174,18 +241,16 @@ class FollowSerializer(serializers.ModelSerializer):
             'email', 'id', 'username',
             'first_name', 'last_name',
             'is_subscribed', 'recipes',
-            'recipes_count', 'avatar',
+            'recipes_count', 'avatar', 'avatar_variants',
         )
 
-    def get_is_subscribed(self, obj):
-        user = self.context['request'].user
-        return user.is_authenticated and \
-            obj.follower.filter(user=user).exists()
+    def get_avatar_variants(self, obj):
+        return get_variant_urls(obj, self.context.get('request'))
 
     def get_recipes(self, obj):
         limit = self.context.get('recipes_limit')
 
-        recipes = Recipe.objects.filter(author=obj)
+        recipes = obj.recipes.all()
         if limit is not None and limit.isdigit():
             recipes = recipes[:int(limit)]
 
@@ -194,6 +259,3 @@ class FollowSerializer(serializers.ModelSerializer):
             many=True,
             context=self.context,
         ).data
-
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
@@ -1 +1,193 @@
+import json
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase
+
+from profiles.models import User
+from recipes.models import (
+    CatalogVersion,
+    Favorite,
+    Ingredient,
+    Recipe,
+    ShoppingCart,
+)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'EXPLAIN требует PostgreSQL')
+class HotQueryIndexTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            email='explain@example.com',
+            username='explain',
+            first_name='explain',
+            last_name='explain',
+        )
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+
+    def test_feed_ordering(self):
+        self.assertUsesIndex(
+            Recipe.objects.order_by('-pub_date', '-id')[:10],
+            'recipe_pub_date_id_idx',
+        )
+
+    def test_author_feed(self):
+        self.assertUsesIndex(
+            Recipe.objects.filter(author=self.user).order_by('-pub_date')[:10],
+            'recipe_author_pub_date_idx',
+        )
+
+    def test_favorite_lookup(self):
+        self.assertUsesIndex(
+            Favorite.objects.filter(user=self.user, recipe_id=1),
+            'unique_favorite_user_recipe',
+        )
+
+    def test_shopping_cart_lookup(self):
+        self.assertUsesIndex(
+            ShoppingCart.objects.filter(user=self.user, recipe_id=1),
+            'unique_shopping_cart_user_recipe',
+        )
+
+
+class ImportIngredientsTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def write(self, name, content):
+        path = self.directory / name
+        path.write_text(content, encoding='utf-8')
+        return path
+
+    def run_import(self, path, **options):
+        stdout = StringIO()
+        call_command('import_ingredients', path=path, stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def get_ingredients(self):
+        return list(Ingredient.objects.order_by('name').values_list(
+            'name', 'measurement_unit',
+        ))
+
+    def test_csv_and_json(self):
+        self.write('a.csv', 'соль,г\n\n перец , г \nсоль,г\n')
+        self.write('b.json', json.dumps([
+            {'name': 'сахар', 'measurement_unit': 'г'},
+            {'name': 'молоко', 'measurement_unit': 'мл'},
+            {'name': 'соль', 'measurement_unit': 'г'},
+        ], ensure_ascii=False))
+        # Items straddle read boundaries.
+        with mock.patch(
+            'recipes.management.commands.import_ingredients.READ_CHUNK_SIZE',
+            7,
+        ):
+            self.run_import(self.directory)
+        self.assertEqual(self.get_ingredients(), [
+            ('молоко', 'мл'), ('перец', 'г'), ('сахар', 'г'), ('соль', 'г'),
+        ])
+
+    def test_rerun_is_idempotent(self):
+        path = self.write('ingredients.csv', 'соль,г\nперец,г\n')
+        self.run_import(path)
+        version = CatalogVersion.get_current().version
+        output = self.run_import(path)
+        self.assertIn('добавлено 0', output)
+        self.assertEqual(Ingredient.objects.count(), 2)
+        self.assertEqual(CatalogVersion.get_current().version, version)
+
+    def test_dry_run(self):
+        path = self.write('ingredients.csv', 'соль,г\n')
+        output = self.run_import(path, dry_run=True)
+        self.assertIn('добавлено 1', output)
+        self.assertFalse(Ingredient.objects.exists())
+
+    def test_malformed_input(self):
+        files = {
+            'object.json': '{"name": "соль"}',
+            'number.json': '[1]',
+            'missing_key.json': '[{"name": "соль"}]',
+            'not_string.json': '[{"name": 1, "measurement_unit": "г"}]',
+            'truncated.json': '[{"name": "соль", "measurement_unit": "г"}',
+            'one_column.csv': 'соль,г\nперец\n',
+            'ingredients.txt': 'соль',
+        }
+        for name, content in files.items():
+            with self.subTest(name=name):
+                path = self.write(name, content)
+                with self.assertRaises(CommandError):
+                    self.run_import(path)
+                self.assertFalse(Ingredient.objects.exists())
+
+
+class MergeDuplicateIngredientsMigrationTests(TransactionTestCase):
+    migrate_from = ('recipes', '0006_catalogversion')
+    migrate_to = ('recipes', '0007_merge_duplicate_ingredients')
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([target])
+        return executor.loader.project_state(target).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+        super().tearDown()
+
+    def test_amounts_of_merged_rows_are_summed(self):
+        apps = self.migrate(self.migrate_from)
+        # Only recipes is rolled back, profiles keeps its current schema.
+        author = User.objects.create(
+            email='merge@example.com', username='merge',
+        )
+        Ingredient = apps.get_model('recipes', 'Ingredient')
+        kept, duplicate = [
+            Ingredient.objects.create(name='соль', measurement_unit='г')
+            for _ in range(2)
+        ]
+        Recipe = apps.get_model('recipes', 'Recipe')
+        both, only_duplicate = [
+            Recipe.objects.create(
+                author_id=author.id, name=name, image='recipes/test.png',
+                text='Описание', cooking_time=5,
+            )
+            for name in ['Оба', 'Дубликат']
+        ]
+        IngredientInRecipe = apps.get_model('recipes', 'IngredientInRecipe')
+        IngredientInRecipe.objects.bulk_create([
+            IngredientInRecipe(recipe=both, ingredient=kept, amount=10),
+            IngredientInRecipe(recipe=both, ingredient=duplicate, amount=5),
+            IngredientInRecipe(
+                recipe=only_duplicate, ingredient=duplicate, amount=7,
+            ),
+        ])
+
+        apps = self.migrate(self.migrate_to)
+        rows = apps.get_model('recipes', 'IngredientInRecipe').objects
+        self.assertEqual(
+            sorted(rows.values_list('recipe_id', 'ingredient_id', 'amount')),
+            [(both.id, kept.id, 15), (only_duplicate.id, kept.id, 7)],
+        )
+        self.assertEqual(
+            list(apps.get_model('recipes', 'Ingredient').objects
+                 .values_list('id', flat=True)),
+            [kept.id],
+        )